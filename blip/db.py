@@ -19,15 +19,20 @@
 #
 
 import datetime
+import hashlib
 import inspect
 import itertools
 import os
+import random
 import re
 import sys
+import threading
+import time
 
 from storm.locals import *
-from storm.expr import Variable, LeftJoin
+from storm.expr import Variable, LeftJoin, Coalesce
 from storm.info import ClassAlias
+import storm.exceptions
 import storm.properties
 import storm.references
 import storm.store
@@ -45,18 +50,72 @@ import blip.scm
 
 
 database = create_database (blinq.config.db_uri)
-stores = {}
+
+# Storm stores can't be shared between threads, so each thread gets its
+# own set of named stores the first time it asks for one.
+_local = threading.local ()
+_blocked_flushes = set()
+def get_stores ():
+    stores = getattr (_local, 'stores', None)
+    if stores is None:
+        stores = _local.stores = {}
+    return stores
+
 def get_store (store):
     if isinstance (store, Store):
         return store
     if hasattr (store, '__blip_store__'):
         return store.__blip_store__
+    stores = get_stores ()
     if not stores.has_key (store):
         stores[store] = Store (database)
+        if store in _blocked_flushes:
+            stores[store].block_implicit_flushes ()
     return stores[store]
 store_options = {'rollback' : False}
 
 
+class ThreadStore (object):
+    """
+    The named store for the current thread, used as __blip_store__.
+    """
+    def __init__ (self, name):
+        self.name = name
+
+    def __get__ (self, obj, cls):
+        return get_store (self.name)
+
+
+class ThreadBuffer (object):
+    """
+    A buffer of pending changes for the current thread, used as a class
+    attribute.
+
+    Model classes collect changes in these and write them when the store is
+    committed.  Since each thread has its own stores, each thread also has
+    its own buffers, made empty by calling factory.  Clear them in place
+    rather than assigning to them.
+    """
+    def __init__ (self, factory):
+        self.factory = factory
+
+    def __get__ (self, obj, cls):
+        buffers = getattr (_local, 'buffers', None)
+        if buffers is None:
+            buffers = _local.buffers = {}
+        if not buffers.has_key (self):
+            buffers[self] = self.factory ()
+        return buffers[self]
+
+# How to write an INSERT that skips existing primary keys, for each of
+# the Storm database backends.
+_insert_ignore = {
+    'SQLite' : ('INSERT OR IGNORE', ''),
+    'Postgres' : ('INSERT', ' ON CONFLICT DO NOTHING'),
+    'MySQL' : ('INSERT IGNORE', '')
+    }
+
+
 def flush (store='default'):
     store = get_store (store)
     store.flush()
@@ -64,6 +123,16 @@ def flush (store='default'):
 
 def commit (store='default'):
     store = get_store (store)
+    if store is Message.__blip_store__:
+        Message.flush_messages ()
+    if store is Queue.__blip_store__:
+        Queue.flush_pushes ()
+    if store is ActivityWeek.__blip_store__:
+        ActivityWeek.flush_counts ()
+    if store is CacheVersion.__blip_store__:
+        CacheVersion.flush_versions ()
+    if store is RecordSummary.__blip_store__:
+        RecordSummary.flush_summaries ()
     if store_options.get ('rollback', False):
         blip.utils.log ('Not committing changes')
     else:
@@ -73,6 +142,16 @@ def commit (store='default'):
 
 def rollback (store='default'):
     store = get_store (store)
+    if store is Message.__blip_store__:
+        Message.discard_messages ()
+    if store is Queue.__blip_store__:
+        Queue.discard_pushes ()
+    if store is ActivityWeek.__blip_store__:
+        ActivityWeek.discard_counts ()
+    if store is CacheVersion.__blip_store__:
+        CacheVersion.discard_versions ()
+    if store is RecordSummary.__blip_store__:
+        RecordSummary.discard_summaries ()
     blip.utils.log ('Rolling back changes')
     try:
         store.rollback ()
@@ -85,6 +164,8 @@ def rollback_all ():
 
 
 def block_implicit_flushes (store='default'):
+    if isinstance (store, basestring):
+        _blocked_flushes.add (store)
     store = get_store (store)
     store.block_implicit_flushes ()
 
@@ -244,7 +325,7 @@ class BlipModelType (storm.properties.PropertyPublisherMeta):
 class BlipModel (Storm, blinq.ext.ExtensionPoint):
     __abstract__ = True
     __metaclass__ = BlipModelType
-    __blip_store__ = get_store ('default')
+    __blip_store__ = ThreadStore ('default')
 
     def __init__ (self, **kw):
         store = get_store (kw.pop ('__blip_store__', self.__class__.__blip_store__))
@@ -295,6 +376,37 @@ class BlipModel (Storm, blinq.ext.ExtensionPoint):
         except IndexError:
             return None
 
+    @classmethod
+    def insert_many (cls, rows, ignore=False, **kw):
+        """
+        Insert rows into the table for this class with multi-row INSERTs.
+
+        Each row is a dictionary mapping column names to values, and every
+        row must have the same keys. This bypasses Storm's object cache,
+        so it doesn't create objects or call __init__.  If ignore is True,
+        rows whose primary key already exists are skipped.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        if len(rows) == 0:
+            return
+        keys = rows[0].keys ()
+        # Stay under SQLite's default limit of 999 parameters.
+        chunk = max (1, 900 // len(keys))
+        rowsql = '(' + ', '.join (['?'] * len(keys)) + ')'
+        (prefix, suffix) = ('INSERT', '')
+        if ignore:
+            (prefix, suffix) = _insert_ignore.get (database.__class__.__name__,
+                                                   ('INSERT', ''))
+        for start in range (0, len(rows), chunk):
+            sub = rows[start:start + chunk]
+            params = []
+            for row in sub:
+                params.extend ([row[key] for key in keys])
+            store.execute ('%s INTO %s (%s) VALUES %s%s'
+                           % (prefix, cls.__storm_table__, ', '.join (keys),
+                              ', '.join ([rowsql] * len(sub)), suffix),
+                           params, noresult=True)
+
     @classmethod
     def get_tables (cls):
         return [tbl
@@ -450,8 +562,18 @@ class BlipRecord (BlipModel):
         olddict = {}
         for rel in old:
             olddict[rel.pred_ident] = rel
+        added = []
         for rel in rels:
-            olddict.pop (rel.pred_ident, None)
+            if olddict.pop (rel.pred_ident, None) is None:
+                added.append (rel)
+        # Only the tabs counting this relation change, and only for
+        # records that gained or lost a row.
+        subj_kinds, pred_kinds = cls.summary_kinds
+        changed = added + olddict.values ()
+        if len(changed) > 0 and len(subj_kinds) > 0:
+            RecordSummary.touch (self, kinds=subj_kinds)
+        if len(pred_kinds) > 0:
+            RecordSummary.touch (*[rel.pred for rel in changed], kinds=pred_kinds)
         oldids = [old.id for old in olddict.values()]
         self.__blip_store__.find (cls, cls.id.is_in (oldids)).remove ()
 
@@ -462,6 +584,10 @@ class BlipRelation (BlipModel):
     subj_ident = Unicode ()
     pred_ident = Unicode ()
 
+    # The RecordSummary counts of the subject and of the predicate
+    # that count this relation
+    summary_kinds = ((), ())
+
     def __repr__ (self):
         return '%s %s %s' % (self.__class__.__name__, self.subj_ident, self.pred_ident)
 
@@ -610,6 +736,44 @@ class ReleaseSet (BlipRecord):
 
     subsets = ReferenceSet ('ReleaseSet.ident', parent_ident)
 
+    @classmethod
+    def get_subsets (cls, idents, **kw):
+        """
+        Get a dictionary mapping each set ident to a list of its subsets.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        subsets = dict ([(ident, []) for ident in idents])
+        for start in range (0, len(idents), 500):
+            sub = idents[start:start + 500]
+            for rset in store.find (cls, cls.parent_ident.is_in (sub)):
+                subsets[rset.parent_ident].append (rset)
+        return subsets
+
+    @classmethod
+    def count_branches (cls, idents, **kw):
+        """
+        Count the branches of each type in each set.
+
+        This returns a dictionary mapping each set ident to a dictionary
+        mapping branch types to counts.  Modules are counted by the modules
+        in the set, and other types by the branches whose parent is one of
+        those modules.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        counts = dict ([(ident, {}) for ident in idents])
+        for start in range (0, len(idents), 500):
+            sub = idents[start:start + 500]
+            sel = store.find ((SetModule.subj_ident, Branch.type, Count ('*')),
+                              Branch.parent_ident == SetModule.pred_ident,
+                              SetModule.subj_ident.is_in (sub))
+            for ident, type, cnt in sel.group_by (SetModule.subj_ident, Branch.type):
+                counts[ident][type] = cnt
+            sel = store.find ((SetModule.subj_ident, Count ('*')),
+                              SetModule.subj_ident.is_in (sub))
+            for ident, cnt in sel.group_by (SetModule.subj_ident):
+                counts[ident][u'Module'] = cnt
+        return counts
+
 
 class Project (BlipRecord):
     score = Int ()
@@ -774,9 +938,17 @@ class Branch (BlipRecord):
         olddict = {}
         for rec in old:
             olddict[rec.ident] = rec
+        changed = False
         for child in children:
-            olddict.pop (child.ident, None)
+            if olddict.pop (child.ident, None) is None:
+                changed = True
             child.parent = self
+        if changed or len(olddict) > 0:
+            RecordSummary.touch_children (self, type)
+        # Pages for the parent list and count their children, so cached
+        # copies of them are stale along with the children's own pages.
+        CacheVersion.bump (self.ident, *([child.ident for child in children] +
+                                         olddict.keys ()))
         for old in olddict.values():
             old.delete ()
 
@@ -816,9 +988,17 @@ class Entity (BlipRecord):
         olddict = {}
         for rec in old:
             olddict[rec.ident] = rec
+        changed = False
         for child in children:
-            olddict.pop (child.ident, None)
+            if olddict.pop (child.ident, None) is None:
+                changed = True
             child.parent = self
+        if changed or len(olddict) > 0:
+            RecordSummary.touch_children (self, type)
+        # Pages for the parent list and count their children, so cached
+        # copies of them are stale along with the children's own pages.
+        CacheVersion.bump (self.ident, *([child.ident for child in children] +
+                                         olddict.keys ()))
         for old in olddict.values():
             old.delete ()
 
@@ -897,6 +1077,9 @@ class Alias (BlipRecord):
         watches = AccountWatch.select (ident=old.ident)
         watches.set (ident=entity.ident)
 
+        # Weekly activity is keyed on idents, not references, so move it.
+        ActivityWeek.move_owner (old.ident, entity.ident)
+
         # And there might be CacheData records. Nuke them.
         for cache in CacheData.select (ident=old.ident):
             cache.delete ()
@@ -1047,6 +1230,8 @@ class DocumentEntity (BlipRelation):
     editor = Bool (default=False)
     publisher = Bool (default=False)
 
+    summary_kinds = (('developers',), ('docs',))
+
 
 class ModuleComponents (BlipRelation):
     subj_ident = ShortText ()
@@ -1070,6 +1255,8 @@ class ModuleEntity (BlipRelation):
     pred = Reference (pred_ident, Entity.ident)
     maintainer = Bool (default=False)
 
+    summary_kinds = (('developers',), ('modules',))
+
 
 class BranchForum (BlipRelation):
     subj_ident = ShortText ()
@@ -1084,6 +1271,8 @@ class SetModule (BlipRelation):
     subj = Reference (subj_ident, ReleaseSet.ident)
     pred = Reference (pred_ident, Branch.ident)
 
+    summary_kinds = (('modules', 'apps', 'docs', 'domains'), ())
+
 
 class TeamMember (BlipRelation):
     subj_ident = ShortText ()
@@ -1092,13 +1281,15 @@ class TeamMember (BlipRelation):
     pred = Reference (pred_ident, Entity.ident)
     coordinator = Bool (default=False)
 
+    summary_kinds = (('members',), ('teams',))
+
 
 ################################################################################
 ## User Accounts
 
 
 class Account (BlipModel):
-    __blip_store__ = get_store ('account')
+    __blip_store__ = ThreadStore ('account')
 
     username = ShortText (primary=True)
     password = ShortText ()
@@ -1117,7 +1308,7 @@ class Account (BlipModel):
 
 class Login (BlipModel):
     __storm_primary__ = 'username', 'ipaddress'
-    __blip_store__ = get_store ('account')
+    __blip_store__ = ThreadStore ('account')
 
     username = ShortText ()
     account = Reference (username, Account.username)
@@ -1164,7 +1355,7 @@ class Login (BlipModel):
 
 class AccountWatch (BlipModel):
     __storm_primary__ = 'username', 'ident'
-    __blip_store__ = get_store ('account')
+    __blip_store__ = ThreadStore ('account')
 
     username = ShortText ()
     account = Reference (username, Account.username)
@@ -1190,7 +1381,9 @@ class AccountWatch (BlipModel):
 
 # FIXME
 class Message (BlipModel):
-    id = Int (primary=True)
+    # A digest of the type, subject, predicate, and day, so each day's
+    # bucket is one row and can be inserted without looking for it first
+    bucket = ShortText (primary=True)
 
     type = ShortText ()
     subj = ShortText ()
@@ -1208,31 +1401,80 @@ class Message (BlipModel):
     def log_create (self):
         pass
 
+    # Pending message counts, keyed on (type, subj, pred, daystart),
+    # with values of [count, latest datetime]. These are written to
+    # the database by flush_messages when the store is committed.
+    _buckets = ThreadBuffer (dict)
+
     @classmethod
     def make_message (cls, type, subj, pred, dt):
         daystart = datetime.datetime (dt.year, dt.month, dt.day)
-        dayend = daystart + datetime.timedelta (days=1)
         if (datetime.datetime.utcnow() - daystart).days > 14:
-            return None
-        filterargs = [blip.db.Message.type == type,
-                      blip.db.Message.datetime >= daystart,
-                      blip.db.Message.datetime < dayend,
-                      blip.db.Message.subj == subj,
-                      blip.db.Message.pred == pred]
-        oldmsg = cls.select (*filterargs)
-        try:
-            oldmsg = oldmsg[0]
-        except:
-            oldmsg = None
-        if oldmsg != None:
-            if oldmsg.count == None:
-                oldmsg.count = 1
-            oldmsg.count = oldmsg.count + 1
-            oldmsg.datetime = max (oldmsg.datetime, dt)
-            return oldmsg
-        msg = cls (type=type, subj=subj, pred=pred, count=1,
-                   datetime=dt, weeknum=blip.utils.weeknum(daystart))
-        return msg
+            return
+        bucket = cls._buckets.get ((type, subj, pred, daystart))
+        if bucket is None:
+            cls._buckets[(type, subj, pred, daystart)] = [1, dt]
+        else:
+            bucket[0] += 1
+            bucket[1] = max (bucket[1], dt)
+
+    @staticmethod
+    def get_bucket (type, subj, pred, daystart):
+        """
+        Get the bucket key for a type, subject, predicate, and day.
+        """
+        key = u'\0'.join ([type, subj, pred or u'', daystart.strftime ('%Y-%m-%d')])
+        return blip.utils.utf8dec (hashlib.sha1 (blip.utils.utf8enc (key)).hexdigest ())
+
+    @classmethod
+    def flush_messages (cls, **kw):
+        """
+        Write pending message counts to the database.
+        """
+        if len(cls._buckets) == 0:
+            return
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        buckets = {}
+        for (type, subj, pred, daystart), (count, dt) in cls._buckets.items ():
+            buckets[cls.get_bucket (type, subj, pred, daystart)] = (type, subj, pred,
+                                                                    daystart, count, dt)
+        cls._buckets.clear ()
+
+        # Make sure every bucket has a row, then add to the rows.  New rows
+        # start at the beginning of the day, so the latest time is always
+        # written below.
+        newrows = [{'bucket': bucket, 'type': type, 'subj': subj, 'pred': pred,
+                    'count': 0, 'datetime': daystart,
+                    'weeknum': blip.utils.weeknum (daystart)}
+                   for bucket, (type, subj, pred, daystart, count, dt) in buckets.items ()]
+        if database.__class__.__name__ not in _insert_ignore:
+            keys = buckets.keys ()
+            for start in range (0, len(keys), 500):
+                sub = keys[start:start + 500]
+                found = set (store.find (cls.bucket, cls.bucket.is_in (sub)))
+                newrows = [row for row in newrows if row['bucket'] not in found]
+        cls.insert_many (newrows, ignore=True, __blip_store__=store)
+
+        counts = {}
+        latest = {}
+        for bucket, (type, subj, pred, daystart, count, dt) in buckets.items ():
+            counts.setdefault (count, []).append (bucket)
+            latest.setdefault (dt, []).append (bucket)
+        for count, keys in counts.items ():
+            for start in range (0, len(keys), 500):
+                sub = keys[start:start + 500]
+                store.find (cls, cls.bucket.is_in (sub)).set (count=cls.count + count)
+        for dt, keys in latest.items ():
+            for start in range (0, len(keys), 500):
+                sub = keys[start:start + 500]
+                store.find (cls, cls.bucket.is_in (sub), cls.datetime < dt).set (datetime=dt)
+
+    @classmethod
+    def discard_messages (cls):
+        """
+        Forget about pending message counts.
+        """
+        cls._buckets.clear ()
 
 
 ################################################################################
@@ -1257,6 +1499,8 @@ class Revision (BlipModel):
     comment = Unicode ()
 
     _file_cache = {}
+    # How many files to hold in _file_cache before flushing it early
+    file_cache_limit = 50000
 
     # FIXME BELOW
     def __init__ (self, **kw):
@@ -1284,13 +1528,24 @@ class Revision (BlipModel):
         cnt = RevisionBranch.select (revision_ident=self.ident, branch_ident=branch.ident).count ()
         if cnt == 0:
             RevisionBranch (revision_ident=self.ident, branch_ident=branch.ident)
+            ActivityWeek.add (branch.ident, u'branch', self.weeknum)
         rfiles = RevisionFile.select (revision_ident=self.ident)
-        for rfile in rfiles:
-            Revision._file_cache.setdefault (branch.ident, {})
-            if not Revision._file_cache[branch.ident].has_key (rfile.filename):
-                Revision._file_cache[branch.ident][rfile.filename] = self
-            elif Revision._file_cache[branch.ident][rfile.filename].datetime < self.datetime:
-                Revision._file_cache[branch.ident][rfile.filename] = self
+        Revision.cache_files (branch.ident, self.ident, self.datetime,
+                              [rfile.filename for rfile in rfiles])
+
+    @classmethod
+    def cache_files (cls, branch_ident, revision_ident, dt, filenames):
+        """
+        Note that a revision touched some files on a branch.
+
+        The latest revision for each file is written to RevisionFileCache
+        by flush_file_cache.
+        """
+        branch_cache = cls._file_cache.setdefault (branch_ident, {})
+        for filename in filenames:
+            old = branch_cache.get (filename)
+            if old is None or old[1] < dt:
+                branch_cache[filename] = (revision_ident, dt)
 
     def display_revision (self, branch=None):
         if branch == None:
@@ -1301,30 +1556,68 @@ class Revision (BlipModel):
             return self.revision
 
     @classmethod
-    def flush_file_cache (cls):
+    def flush_file_cache (cls, limit=None):
+        """
+        Write the latest revision for each cached file to RevisionFileCache.
+
+        Existing cache rows for each branch are loaded with one query and
+        compared in memory. New rows are added with multi-row INSERTs, and
+        changed rows are updated with one UPDATE for each revision. If limit
+        is given, nothing is written unless more than limit files are cached.
+        """
+        if limit is not None:
+            size = sum ([len(branch_cache) for branch_cache in cls._file_cache.values ()])
+            if size <= limit:
+                return
+        store = get_store (RevisionFileCache)
+        store.flush ()
         for branch_ident in cls._file_cache.keys ():
             branch_cache = cls._file_cache.pop (branch_ident)
-            for filename in branch_cache.keys ():
-                revision = branch_cache.pop (filename)
-                sel = RevisionFileCache.select_with_revision (branch_ident=branch_ident, filename=filename)
-                try:
-                    cache, oldrev = sel[0]
-                    if revision.datetime > oldrev.datetime:
-                        cache.revision_ident = revision.ident
-                except IndexError:
-                    RevisionFileCache (branch_ident=branch_ident,
-                                       filename=filename,
-                                       revision_ident=revision.ident)
-            flush (RevisionFileCache)
+            using = store.using (LeftJoin (RevisionFileCache, Revision,
+                                           RevisionFileCache.revision_ident == Revision.ident))
+            olddates = dict (using.find ((RevisionFileCache.filename, Revision.datetime),
+                                         RevisionFileCache.branch_ident == branch_ident))
+            inserts = []
+            updates = {}
+            for filename, (revision_ident, revision_datetime) in branch_cache.items ():
+                if not olddates.has_key (filename):
+                    inserts.append ({'branch_ident': branch_ident,
+                                     'filename': filename,
+                                     'revision_ident': revision_ident})
+                elif olddates[filename] is None or revision_datetime > olddates[filename]:
+                    updates.setdefault (revision_ident, []).append (filename)
+            RevisionFileCache.insert_many (inserts)
+            for revision_ident, filenames in updates.items ():
+                for start in range (0, len(filenames), 500):
+                    sel = store.find (RevisionFileCache,
+                                      RevisionFileCache.branch_ident == branch_ident,
+                                      RevisionFileCache.filename.is_in (filenames[start:start + 500]))
+                    sel.set (revision_ident=revision_ident)
 
     @classmethod
     def get_last_revision (cls, **kw):
         try:
             ret = cls._get_last_revision_cached (**kw)
         except:
-            ret = cls._get_last_revision_expensive (**kw)
+            try:
+                ret = cls._get_last_revision_head (**kw)
+            except:
+                ret = cls._get_last_revision_expensive (**kw)
         return ret
 
+    @classmethod
+    def _get_last_revision_head (cls, **kw):
+        if kw.has_key ('branch') and len(kw) == 1:
+            branch_ident = kw['branch'].ident
+        elif kw.has_key ('branch_ident') and len(kw) == 1:
+            branch_ident = kw['branch_ident']
+        else:
+            raise blip.utils.BlipException ('Cannot fetch from branch head')
+        head = BranchHead.get (branch_ident)
+        if head is None:
+            raise blip.utils.BlipException ('No head for %s' % branch_ident)
+        return cls.get (head.revision_ident)
+
     @classmethod
     def _get_last_revision_cached (cls, **kw):
         args = []
@@ -1454,6 +1747,40 @@ class Revision (BlipModel):
         return sel.count (Revision.ident, distinct=True)
 
 
+class BranchHead (BlipModel):
+    """
+    The latest revision on a branch, maintained as history is read.
+    """
+    branch_ident = ShortText (primary=True)
+    branch = Reference (branch_ident, Branch.ident)
+
+    revision_ident = ShortText ()
+    revision = Reference (revision_ident, Revision.ident)
+
+    datetime = DateTime ()
+
+    person_ident = ShortText ()
+    person = Reference (person_ident, Entity.ident)
+
+    def log_create (self):
+        pass
+
+    @classmethod
+    def set_head (cls, branch, revision_ident, dt, person_ident):
+        """
+        Record a revision as the head of a branch, if it's the latest one.
+        """
+        head = cls.get (branch.ident)
+        if head is None:
+            return cls (branch_ident=branch.ident, revision_ident=revision_ident,
+                        datetime=dt, person_ident=person_ident)
+        if head.datetime is None or dt > head.datetime:
+            head.revision_ident = revision_ident
+            head.datetime = dt
+            head.person_ident = person_ident
+        return head
+
+
 class RevisionBranch (BlipModel):
     __storm_primary__ = 'revision_ident', 'branch_ident'
 
@@ -1467,6 +1794,430 @@ class RevisionBranch (BlipModel):
         pass
 
 
+class CacheVersion (BlipModel):
+    """
+    A version for each record that changes whenever sweeps update it.
+
+    The web application keeps cached pages along with the versions of the
+    records they show, and rebuilds them when a version changes.  Versions
+    bumped with bump are written when the store is committed.
+    """
+    ident = ShortText (primary=True)
+    version = Int ()
+
+    _pending = ThreadBuffer (set)
+
+    def log_create (self):
+        pass
+
+    @classmethod
+    def bump (cls, *idents):
+        """
+        Mark records as changed.
+        """
+        cls._pending.update ([ident for ident in idents if ident is not None])
+
+    @classmethod
+    def flush_versions (cls, **kw):
+        """
+        Write versions bumped with bump to the database.
+        """
+        if len(cls._pending) == 0:
+            return
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        idents = list(cls._pending)
+        cls._pending.clear ()
+        for start in range (0, len(idents), 500):
+            sub = idents[start:start + 500]
+            store.find (cls, cls.ident.is_in (sub)).set (version=cls.version + 1)
+        cls.insert_many ([{'ident': ident, 'version': 1} for ident in idents],
+                         ignore=True, __blip_store__=store)
+
+    @classmethod
+    def discard_versions (cls):
+        """
+        Forget versions bumped with bump without writing them.
+        """
+        cls._pending.clear ()
+
+    @classmethod
+    def get_versions (cls, idents, **kw):
+        """
+        Get a tuple of the versions of idents, with 0 for unknown idents.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        versions = dict (store.find ((cls.ident, cls.version), cls.ident.is_in (idents)))
+        return tuple ([versions.get (ident, 0) for ident in idents])
+
+
+class ScoreRank (BlipModel):
+    """
+    The rank and percentile of a record's score among records of its kind.
+
+    These are recomputed by the scores sweep, so pages can show them without
+    counting every record with a higher or lower score.
+    """
+    ident = ShortText (primary=True)
+    kind = ShortText ()
+    rank = Int ()
+    percentile = Float ()
+
+    def log_create (self):
+        pass
+
+    @classmethod
+    def set_ranks (cls, kind, scores, **kw):
+        """
+        Replace the ranks for a kind from (ident, score) tuples.
+
+        The rank is one more than the number of records with a higher score.
+        The percentile is the share of records with a nonzero score no higher
+        than this one, among those and the records with a higher score.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        scores = sorted ([(score or 0, ident) for ident, score in scores], reverse=True)
+        numzero = len([score for score, ident in scores if score == 0])
+        total = len(scores)
+        rows = []
+        start = 0
+        while start < total:
+            score = scores[start][0]
+            end = start
+            while end < total and scores[end][0] == score:
+                end += 1
+            if score == 0:
+                lt = 0
+            else:
+                lt = total - numzero - start
+            if lt + start > 0:
+                percentile = (100.0 * lt) / (lt + start)
+            else:
+                percentile = None
+            for i in range (start, end):
+                rows.append ({'ident': scores[i][1], 'kind': kind,
+                              'rank': start + 1, 'percentile': percentile})
+            start = end
+        store.find (cls, cls.kind == kind).remove ()
+        cls.insert_many (rows, __blip_store__=store)
+
+    @classmethod
+    def get_rank (cls, ident, **kw):
+        """
+        Get a tuple of the rank and percentile for an ident, or None.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        return store.find ((cls.rank, cls.percentile), cls.ident == ident).one ()
+
+
+class RecordSummary (BlipModel):
+    """
+    Counts of related records, shown in the tabs of a record's page.
+
+    Sweeps mark records with touch when they change what the record is
+    related to, and the counts are recomputed when the store is committed.
+    Pages look up one summary instead of counting each kind of relation.
+    """
+    ident = ShortText (primary=True)
+    counts = Pickle (default_factory=dict)
+
+    _pending = ThreadBuffer (dict)
+
+    def log_create (self):
+        pass
+
+    # The counts of a parent that change when its children of a type do
+    child_kinds = {
+        u'Application': ('apps',),
+        u'Document': ('docs',),
+        u'DocumentPage': ('pages',),
+        u'Domain': ('translations',),
+        u'Translation': ('translations',),
+        u'Team': ('subteams',)
+        }
+
+    @classmethod
+    def touch (cls, *records, **kw):
+        """
+        Mark records whose counts need to be recomputed.
+
+        If kinds is given, only those counts are recomputed for records
+        that already have a summary.
+        """
+        kinds = kw.get ('kinds')
+        for record in records:
+            if record is None:
+                continue
+            pending = cls._pending.get (record.ident)
+            if pending is None:
+                cls._pending[record.ident] = [record, None if kinds is None else set (kinds)]
+            elif pending[1] is not None:
+                if kinds is None:
+                    pending[1] = None
+                else:
+                    pending[1].update (kinds)
+
+    @classmethod
+    def touch_children (cls, parent, type):
+        """
+        Mark the counts of parent that change when its children of type do.
+        """
+        kinds = cls.child_kinds.get (type)
+        if kinds is None:
+            return
+        cls.touch (parent, kinds=kinds)
+        # Modules count the translations in all their domains.
+        if type == u'Translation' and parent.type == u'Domain':
+            cls.touch (parent.parent, kinds=kinds)
+
+    @classmethod
+    def flush_summaries (cls, **kw):
+        """
+        Recompute and write the counts for records marked with touch.
+        """
+        if len(cls._pending) == 0:
+            return
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        pending = cls._pending.values ()
+        cls._pending.clear ()
+        for record, kinds in pending:
+            summary = store.get (cls, record.ident)
+            if summary is None:
+                counts = cls.count_record (record)
+                cls (ident=record.ident, counts=counts, __blip_store__=store)
+            elif kinds is None:
+                summary.counts = cls.count_record (record)
+            else:
+                # Assign a new dict, so Storm sees the pickled value change.
+                counts = dict (summary.counts)
+                counts.update (cls.count_record (record, kinds))
+                summary.counts = counts
+
+    @classmethod
+    def discard_summaries (cls):
+        """
+        Forget records marked with touch without recomputing them.
+        """
+        cls._pending.clear ()
+
+    @classmethod
+    def get_counts (cls, ident, **kw):
+        """
+        Get the dictionary of counts for an ident, or None.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        return store.find (cls.counts, cls.ident == ident).one ()
+
+    @classmethod
+    def count_record (cls, record, kinds=None):
+        """
+        Count the records related to a record, keyed by the tab they go in.
+
+        If kinds is given, only those counts are made.
+        """
+        want = lambda kind: kinds is None or kind in kinds
+        counts = {}
+        if isinstance (record, Branch):
+            if record.type == u'Module':
+                if want ('developers'):
+                    counts['developers'] = ModuleEntity.count_related (subj=record)
+                if want ('apps'):
+                    counts['apps'] = Branch.select (type=u'Application', parent=record).count ()
+                if want ('docs'):
+                    counts['docs'] = Branch.select (type=u'Document', parent=record).count ()
+                if want ('translations'):
+                    store = get_store (Branch)
+                    domain = ClassAlias (Branch)
+                    using = store.using (LeftJoin (Branch, domain,
+                                                   Branch.parent_ident == domain.ident))
+                    counts['translations'] = using.find (Branch.scm_file,
+                                                         Branch.type == u'Translation',
+                                                         domain.type == u'Domain',
+                                                         domain.parent_ident == record.ident
+                                                         ).config(distinct=True).count()
+            elif record.type == u'Document':
+                if want ('developers'):
+                    counts['developers'] = DocumentEntity.count_related (subj=record)
+                if want ('pages'):
+                    counts['pages'] = record.select_children (u'DocumentPage').count ()
+                if want ('translations'):
+                    counts['translations'] = Branch.select (parent=record,
+                                                            type=u'Translation').count ()
+        elif isinstance (record, Entity):
+            if want ('posts'):
+                counts['posts'] = ForumPost.select (author=record).count ()
+            if want ('modules'):
+                counts['modules'] = ModuleEntity.count_related (pred=record)
+            if want ('docs'):
+                counts['docs'] = DocumentEntity.count_related (pred=record,
+                                                               subj_type=u'Document')
+            if record.type == u'Person':
+                if want ('commits'):
+                    counts['commits'] = Revision.select (person=record).count ()
+                if want ('teams'):
+                    counts['teams'] = TeamMember.count_related (pred=record)
+            elif record.type == u'Team':
+                if want ('members'):
+                    counts['members'] = TeamMember.count_related (subj=record)
+                if want ('subteams'):
+                    counts['subteams'] = Entity.select (Entity.type == u'Team',
+                                                        Entity.parent_ident == record.ident).count ()
+        elif isinstance (record, Forum):
+            if record.type == u'List':
+                if want ('posts'):
+                    counts['posts'] = ForumPost.select (forum=record).count ()
+        elif isinstance (record, ReleaseSet):
+            branches = ReleaseSet.count_branches ([record.ident])[record.ident]
+            if want ('subsets'):
+                counts['subsets'] = record.subsets.count ()
+            counts['modules'] = branches.get (u'Module', 0)
+            counts['apps'] = branches.get (u'Application', 0)
+            counts['docs'] = branches.get (u'Document', 0)
+            counts['domains'] = branches.get (u'Domain', 0)
+        return counts
+
+
+class ActivityWeek (BlipModel):
+    """
+    Weekly counts of revisions and posts, kept up to date as they're added.
+
+    The kind is u'branch' for revisions on a branch, u'person' for revisions
+    by a person, or u'forum' for posts to a forum.  Counts are collected in
+    memory with add and written when the store is committed.  Use rebuild to
+    recount everything from the Revision, RevisionBranch, and ForumPost tables.
+    """
+    __storm_primary__ = 'owner_ident', 'kind', 'weeknum'
+
+    owner_ident = ShortText ()
+    kind = ShortText ()
+    weeknum = Int ()
+    count = Int ()
+
+    _pending = ThreadBuffer (dict)
+
+    def log_create (self):
+        pass
+
+    @classmethod
+    def add (cls, owner_ident, kind, weeknum, count=1):
+        """
+        Add to the count for an owner in a week.
+        """
+        if owner_ident is None or weeknum is None:
+            return
+        key = (owner_ident, kind, weeknum)
+        cls._pending[key] = cls._pending.get (key, 0) + count
+
+    @classmethod
+    def flush_counts (cls, **kw):
+        """
+        Write counts collected with add to the database.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        pending = dict ([(key, count) for key, count in cls._pending.iteritems ()
+                         if count != 0])
+        cls._pending.clear ()
+        if len(pending) == 0:
+            return
+        # Make sure every week has a row first, then add to the counts.  If
+        # another worker creates the same week in between, the insert skips
+        # it and the update still adds to it.
+        newrows = [{'owner_ident': owner_ident, 'kind': kind,
+                    'weeknum': weeknum, 'count': 0}
+                   for (owner_ident, kind, weeknum) in pending.keys ()]
+        if database.__class__.__name__ not in _insert_ignore:
+            newrows = [row for row in newrows
+                       if store.find (cls,
+                                      cls.owner_ident == row['owner_ident'],
+                                      cls.kind == row['kind'],
+                                      cls.weeknum == row['weeknum']).is_empty ()]
+        cls.insert_many (newrows, ignore=True, __blip_store__=store)
+        groups = {}
+        for (owner_ident, kind, weeknum), count in pending.iteritems ():
+            groups.setdefault ((kind, weeknum, count), []).append (owner_ident)
+        for (kind, weeknum, count), owners in groups.iteritems ():
+            for start in range (0, len(owners), 500):
+                sub = owners[start:start + 500]
+                store.find (cls, cls.kind == kind, cls.weeknum == weeknum,
+                            cls.owner_ident.is_in (sub)).set (count=cls.count + count)
+
+    @classmethod
+    def move_owner (cls, old_ident, new_ident, **kw):
+        """
+        Move all the counts for one owner onto another.
+
+        Counts for weeks the new owner already has are added together.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        cls.flush_counts (__blip_store__=store)
+        sel = store.find ((cls.kind, cls.weeknum, cls.count),
+                          cls.owner_ident == old_ident)
+        for kind, weeknum, count in list(sel):
+            cls.add (new_ident, kind, weeknum, count)
+        store.find (cls, cls.owner_ident == old_ident).remove ()
+        cls.flush_counts (__blip_store__=store)
+
+    @classmethod
+    def discard_counts (cls):
+        """
+        Forget counts collected with add without writing them.
+        """
+        cls._pending.clear ()
+
+    @classmethod
+    def select_counts (cls, kind, *args, **kw):
+        """
+        Select (owner_ident, weeknum, count) tuples for a kind.
+
+        This only reads from the database, so sweeps should call
+        flush_counts first to include counts collected with add.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        return store.find ((cls.owner_ident, cls.weeknum, cls.count),
+                           cls.kind == kind, cls.count > 0, *args)
+
+    @classmethod
+    def get_counts (cls, owner_ident, kind, *args, **kw):
+        """
+        Get a list of (weeknum, count) tuples for an owner, ordered by week.
+
+        This only reads from the database, so sweeps should call
+        flush_counts first to include counts collected with add.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        sel = store.find ((cls.weeknum, cls.count),
+                          cls.owner_ident == owner_ident, cls.kind == kind,
+                          cls.count > 0, *args)
+        return list(sel.order_by (cls.weeknum))
+
+    @classmethod
+    def rebuild (cls, **kw):
+        """
+        Recount everything from the revision and post tables.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        cls._pending.clear ()
+        store.find (cls).remove ()
+        sql = ('INSERT INTO %s (owner_ident, kind, weeknum, count) '
+               'SELECT %%s, ?, %%s, COUNT(*) FROM %%s WHERE %%s '
+               'GROUP BY %%s, %%s' % cls.__storm_table__)
+        store.execute (sql % ('RevisionBranch.branch_ident', 'Revision.weeknum',
+                              'Revision JOIN RevisionBranch'
+                              ' ON RevisionBranch.revision_ident = Revision.ident',
+                              'Revision.weeknum IS NOT NULL',
+                              'RevisionBranch.branch_ident', 'Revision.weeknum'),
+                       (u'branch',), noresult=True)
+        store.execute (sql % ('Revision.person_ident', 'Revision.weeknum', 'Revision',
+                              'Revision.weeknum IS NOT NULL'
+                              ' AND Revision.person_ident IS NOT NULL',
+                              'Revision.person_ident', 'Revision.weeknum'),
+                       (u'person',), noresult=True)
+        store.execute (sql % ('ForumPost.forum_ident', 'ForumPost.weeknum', 'ForumPost',
+                              'ForumPost.weeknum IS NOT NULL'
+                              ' AND ForumPost.forum_ident IS NOT NULL',
+                              'ForumPost.forum_ident', 'ForumPost.weeknum'),
+                       (u'forum',), noresult=True)
+
+
 class RevisionFile (BlipModel):
     __storm_primary__ = 'revision_ident', 'filename'
 
@@ -1595,6 +2346,37 @@ class OutputFile (BlipModel):
             os.makedirs (dirname)
 
 
+# Timestamp and Error records are keyed on the function that set them,
+# as module.function. Callers can pass that key explicitly with the
+# sourcefunc keyword argument, usually from get_sourcefunc. Otherwise we
+# look for the first caller outside this module on the call stack.
+_sourcefunc_keys = {}
+
+def get_sourcefunc (func):
+    """
+    Get the sourcefunc key for a function or method.
+    """
+    func = getattr (func, 'im_func', func)
+    code = func.func_code
+    key = _sourcefunc_keys.get (code)
+    if key is None:
+        key = unicode (func.__module__ + '.' + func.__name__)
+        _sourcefunc_keys[code] = key
+    return key
+
+
+def _find_sourcefunc ():
+    frame = sys._getframe (1)
+    while frame.f_back is not None and frame.f_globals.get ('__name__') == __name__:
+        frame = frame.f_back
+    code = frame.f_code
+    key = _sourcefunc_keys.get (code)
+    if key is None:
+        key = unicode (frame.f_globals.get ('__name__') + '.' + code.co_name)
+        _sourcefunc_keys[code] = key
+    return key
+
+
 class Timestamp (BlipModel):
     __storm_primary__ = 'filename', 'sourcefunc'
     filename = Unicode ()
@@ -1607,41 +2389,151 @@ class Timestamp (BlipModel):
     class stamped:
         class stampedout (Exception):
             pass
-        def __init__ (self, filename, repository):
+        def __init__ (self, filename, repository, sourcefunc=None):
             self.filename = filename
             self.repository = repository
+            if sourcefunc is None:
+                sourcefunc = Timestamp._get_sourcefunc ()
+            self.sourcefunc = sourcefunc
+            self.digest = None
             if repository is None:
                 self.rel_scm = filename
             else:
                 self.rel_scm = blip.utils.relative_path (filename, blinq.config.scm_dir)
         def check (self, check):
-            self.mtime = int(os.stat(self.filename).st_mtime)
+            stat = os.stat(self.filename)
+            self.mtime = int(stat.st_mtime)
+            self.size = stat.st_size
             if check:
-                stamp = blip.db.Timestamp.get_timestamp (self.rel_scm)
+                stamp = blip.db.Timestamp.get_timestamp (self.rel_scm,
+                                                          sourcefunc=self.sourcefunc)
                 if self.mtime <= stamp:
                     raise Timestamp.stamped.stampedout(None)
+                if blinq.config.sweep_digests:
+                    # The mtime changed, but the file might not have. Only
+                    # read the file if the size is the same as last time.
+                    old = Timestamp.get_digest (self.rel_scm, sourcefunc=self.sourcefunc)
+                    if old is not None and old[0] == self.size:
+                        self.digest = Timestamp.file_digest (self.filename)
+                        if self.digest == old[1]:
+                            Timestamp.set_timestamp (self.rel_scm, self.mtime,
+                                                     sourcefunc=self.sourcefunc)
+                            raise Timestamp.stamped.stampedout(None)
         def log (self):
             blip.utils.log ('Processing %s' % self.rel_scm)
         def __enter__ (self):
             return self
         def __exit__ (self, type, value, tb):
             if type is None:
-                Timestamp.set_timestamp (self.rel_scm, self.mtime)
+                Timestamp.set_timestamp (self.rel_scm, self.mtime,
+                                         sourcefunc=self.sourcefunc)
+                if blinq.config.sweep_digests:
+                    if self.digest is None:
+                        self.digest = Timestamp.file_digest (self.filename)
+                    Timestamp.set_digest (self.rel_scm, self.size, self.digest,
+                                          sourcefunc=self.sourcefunc)
             else:
                 if issubclass(type, Timestamp.stamped.stampedout):
                     return True
 
+    # Between start_preload and end_preload, timestamps for files under
+    # _preload_prefix are read from and written to _preloaded, which maps
+    # (filename, sourcefunc) to stamps. _preloaded_digests does the same
+    # for (size, digest) pairs. The _changed sets hold the keys that need
+    # to be written back to the database.
+    _preload_prefix = None
+    _preloaded = {}
+    _preloaded_changed = set ()
+    _preloaded_digests = {}
+    _preloaded_digests_changed = set ()
+
+    @classmethod
+    def start_preload (cls, prefix):
+        """
+        Load every timestamp for files whose names start with prefix.
+        """
+        store = get_store (cls.__blip_store__)
+        cls._preload_prefix = prefix
+        cls._preloaded = dict ([((filename, sfunc), stamp)
+                                for filename, sfunc, stamp in
+                                store.find ((cls.filename, cls.sourcefunc, cls.stamp),
+                                            cls.filename.startswith (prefix))])
+        cls._preloaded_changed = set ()
+        cls._preloaded_digests = {}
+        if blinq.config.sweep_digests:
+            cls._preloaded_digests = dict ([((filename, sfunc), (size, digest))
+                                            for filename, sfunc, size, digest in
+                                            store.find ((TimestampDigest.filename,
+                                                         TimestampDigest.sourcefunc,
+                                                         TimestampDigest.size,
+                                                         TimestampDigest.digest),
+                                                        TimestampDigest.filename.startswith (prefix))])
+        cls._preloaded_digests_changed = set ()
+
+    @classmethod
+    def end_preload (cls, write=True):
+        """
+        Stop using preloaded timestamps, writing back any changed ones.
+        """
+        stamps = cls._preloaded
+        stamps_changed = cls._preloaded_changed
+        digests = cls._preloaded_digests
+        digests_changed = cls._preloaded_digests_changed
+        cls._preload_prefix = None
+        cls._preloaded = {}
+        cls._preloaded_changed = set ()
+        cls._preloaded_digests = {}
+        cls._preloaded_digests_changed = set ()
+        if not write:
+            return
+        cls._replace_rows (cls, stamps_changed,
+                           [{'filename': filename, 'sourcefunc': sfunc,
+                             'stamp': stamps[(filename, sfunc)]}
+                            for filename, sfunc in stamps_changed])
+        cls._replace_rows (TimestampDigest, digests_changed,
+                           [{'filename': filename, 'sourcefunc': sfunc,
+                             'size': digests[(filename, sfunc)][0],
+                             'digest': digests[(filename, sfunc)][1]}
+                            for filename, sfunc in digests_changed])
+
+    @staticmethod
+    def _replace_rows (table, keys, rows):
+        """
+        Replace rows keyed on (filename, sourcefunc) in a batch.
+
+        Old rows are removed with one DELETE for each sourcefunc, and
+        the new rows are added with multi-row INSERTs.
+        """
+        if len(keys) == 0:
+            return
+        store = get_store (table.__blip_store__)
+        store.flush ()
+        bysfunc = {}
+        for filename, sfunc in keys:
+            bysfunc.setdefault (sfunc, []).append (filename)
+        for sfunc, filenames in bysfunc.items ():
+            for start in range (0, len(filenames), 500):
+                store.find (table, table.sourcefunc == sfunc,
+                            table.filename.is_in (filenames[start:start + 500])).remove ()
+        table.insert_many (rows)
+
+    @classmethod
+    def _is_preloaded (cls, filename):
+        return (cls._preload_prefix is not None and
+                filename.startswith (cls._preload_prefix))
+
     @classmethod
     def _get_sourcefunc (cls):
-        for frame in inspect.stack():
-            mod = inspect.getmodule(frame[0])
-            if mod == sys.modules[__name__]:
-                continue
-            return unicode(mod.__name__ + '.' + frame[3])
+        return _find_sourcefunc ()
 
     @classmethod
-    def set_timestamp (cls, filename, stamp):
-        sfunc = cls._get_sourcefunc()
+    def set_timestamp (cls, filename, stamp, sourcefunc=None):
+        sfunc = sourcefunc or cls._get_sourcefunc()
+        filename = blip.utils.utf8dec (filename)
+        if cls._is_preloaded (filename):
+            cls._preloaded[(filename, sfunc)] = int(stamp)
+            cls._preloaded_changed.add ((filename, sfunc))
+            return
         obj = cls.select (filename=filename, sourcefunc=sfunc)
         try:
             obj = obj[0]
@@ -1650,14 +2542,78 @@ class Timestamp (BlipModel):
             cls (filename=filename, sourcefunc=sfunc, stamp=int(stamp))
 
     @classmethod
-    def get_timestamp (cls, filename):
-        sfunc = cls._get_sourcefunc()
+    def get_timestamp (cls, filename, sourcefunc=None):
+        sfunc = sourcefunc or cls._get_sourcefunc()
+        filename = blip.utils.utf8dec (filename)
+        if cls._is_preloaded (filename):
+            return cls._preloaded.get ((filename, sfunc), -1)
         obj = cls.select (filename=filename, sourcefunc=sfunc)
         try:
             return obj[0].stamp
         except IndexError:
             return -1
 
+    @staticmethod
+    def file_digest (filename):
+        """
+        Get a digest of the contents of a file.
+        """
+        digest = hashlib.sha1 ()
+        fd = open (filename, 'rb')
+        try:
+            buf = fd.read (65536)
+            while buf:
+                digest.update (buf)
+                buf = fd.read (65536)
+        finally:
+            fd.close ()
+        return unicode (digest.hexdigest ())
+
+    @classmethod
+    def set_digest (cls, filename, size, digest, sourcefunc=None):
+        sfunc = sourcefunc or cls._get_sourcefunc()
+        filename = blip.utils.utf8dec (filename)
+        if cls._is_preloaded (filename):
+            cls._preloaded_digests[(filename, sfunc)] = (size, digest)
+            cls._preloaded_digests_changed.add ((filename, sfunc))
+            return
+        obj = TimestampDigest.get ((filename, sfunc))
+        if obj is None:
+            TimestampDigest (filename=filename, sourcefunc=sfunc, size=size, digest=digest)
+        else:
+            obj.size = size
+            obj.digest = digest
+
+    @classmethod
+    def get_digest (cls, filename, sourcefunc=None):
+        """
+        Get the size and digest recorded for a file, or None.
+        """
+        sfunc = sourcefunc or cls._get_sourcefunc()
+        filename = blip.utils.utf8dec (filename)
+        if cls._is_preloaded (filename):
+            return cls._preloaded_digests.get ((filename, sfunc))
+        obj = TimestampDigest.get ((filename, sfunc))
+        if obj is None:
+            return None
+        return (obj.size, obj.digest)
+
+
+class TimestampDigest (BlipModel):
+    """
+    The size and content digest of a file when it was last processed.
+
+    These are only kept when the sweep_digests option is set.
+    """
+    __storm_primary__ = 'filename', 'sourcefunc'
+    filename = Unicode ()
+    sourcefunc = Unicode ()
+    size = Int ()
+    digest = ShortText ()
+
+    def log_create (self):
+        pass
+
 
 class Error (BlipModel):
     __storm_primary__ = 'ident', 'sourcefunc'
@@ -1672,23 +2628,19 @@ class Error (BlipModel):
         blip.utils.log ('Clearing error %s on %s' % (self.sourcefunc, self.ident))
 
     @classmethod
-    def _get_sourcefunc (cls, ctxt):
-        for frame in inspect.stack():
-            mod = inspect.getmodule(frame[0])
-            if mod == sys.modules[__name__]:
-                continue
-            ret = unicode(mod.__name__ + '.' + frame[3])
-            if ctxt is not None:
-                ret = ret + u'#' + unicode (ctxt)
-            return ret
+    def _get_sourcefunc (cls, ctxt, sourcefunc=None):
+        ret = sourcefunc or _find_sourcefunc ()
+        if ctxt is not None:
+            ret = ret + u'#' + unicode (ctxt)
+        return ret
 
     @classmethod
-    def set_error (cls, ident, message, ctxt=None):
+    def set_error (cls, ident, message, ctxt=None, sourcefunc=None):
         if isinstance (ident, basestring):
             ident = blinq.utils.utf8dec (ident)
         else:
             ident = ident.ident
-        sfunc = cls._get_sourcefunc (ctxt)
+        sfunc = cls._get_sourcefunc (ctxt, sourcefunc)
         message = blinq.utils.utf8dec (message)
         obj = cls.select (ident=ident, sourcefunc=sfunc)
         try:
@@ -1698,33 +2650,33 @@ class Error (BlipModel):
             cls (ident=ident, sourcefunc=sfunc, message = message)
 
     @classmethod
-    def clear_error (cls, ident, ctxt=None):
+    def clear_error (cls, ident, ctxt=None, sourcefunc=None):
         if isinstance (ident, basestring):
             ident = blinq.utils.utf8dec (ident)
         else:
             ident = ident.ident
-        sfunc = cls._get_sourcefunc (ctxt)
+        sfunc = cls._get_sourcefunc (ctxt, sourcefunc)
         for err in cls.select (ident=ident, sourcefunc=sfunc):
             err.delete ()
 
     @classmethod
-    def clear_all(cls, ident):
+    def clear_all(cls, ident, sourcefunc=None):
         if isinstance(ident, basestring):
             ident = blinq.utils.utf8dec(ident)
         else:
             ident = ident.ident
-        sfunc = cls._get_sourcefunc(None)
+        sfunc = cls._get_sourcefunc(None, sourcefunc)
         sfunc = sfunc + u'#%'
         for err in cls.select(Error.ident == ident, Error.sourcefunc.like(sfunc)):
             err.delete()
 
     class catch:
-        def __init__ (self, ident, message=None, ctxt=None):
+        def __init__ (self, ident, message=None, ctxt=None, sourcefunc=None):
             if isinstance (ident, basestring):
                 self.ident = blinq.utils.utf8dec (ident)
             else:
                 self.ident = ident.ident
-            self.sfunc = Error._get_sourcefunc (ctxt)
+            self.sfunc = Error._get_sourcefunc (ctxt, sourcefunc)
             self.message = message and blinq.utils.utf8dec (message) or None
         def __enter__ (self):
             return self
@@ -1746,22 +2698,58 @@ class Error (BlipModel):
 
 class Queue (BlipModel):
     ident = ShortText (primary=True)
-    cache = {}
+
+    # Pushed idents are collected here and written in one statement when
+    # there are push_batch of them, or when the store is committed.
+    _pushes = ThreadBuffer (set)
+    push_batch = 500
 
     def log_create (self):
         pass
 
     @classmethod
     def push (cls, ident, **kw):
-        if not cls.cache.get (ident, False):
-            store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
-            if cls.select (cls.ident == ident).count () == 0:
-                cls (ident=ident, __blip_store__=store)
-            cls.cache[ident] = True
+        cls.push_many ([ident], **kw)
+
+    @classmethod
+    def push_many (cls, idents, **kw):
+        """
+        Add objects to the queue, if they aren't already queued.
+        """
+        cls._pushes.update (idents)
+        if len(cls._pushes) >= cls.push_batch:
+            cls.flush_pushes (**kw)
+
+    @classmethod
+    def flush_pushes (cls, **kw):
+        """
+        Write pushed idents to the database.
+        """
+        if len(cls._pushes) == 0:
+            return
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        idents = list(cls._pushes)
+        cls._pushes.clear ()
+        if database.__class__.__name__ not in _insert_ignore:
+            for start in range (0, len(idents), 500):
+                sub = idents[start:start + 500]
+                for ident in store.find (cls.ident, cls.ident.is_in (sub)):
+                    idents.remove (ident)
+        cls.insert_many ([{'ident': ident} for ident in idents],
+                         ignore=True, __blip_store__=store)
+
+    @classmethod
+    def discard_pushes (cls):
+        """
+        Forget pushed idents without writing them.
+        """
+        cls._pushes.clear ()
 
     @classmethod
     def pop (cls, ident=None, **kw):
         store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        if ident is not None:
+            cls._pushes.discard (ident)
         try:
             if ident is not None:
                 sel = cls.select(cls.ident.like (ident))[0]
@@ -1776,8 +2764,185 @@ class Queue (BlipModel):
     @classmethod
     def remove (cls, ident, **kw):
         store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        cls._pushes.discard (ident)
         try:
             rec = cls.select (ident=ident)
             store.remove (rec)
         except:
             pass
+
+
+class QueueLease (BlipModel):
+    """
+    A claim on a queued object by a worker processing the queue.
+
+    Workers claim objects before processing them, so that several sweep
+    processes can work through the queue at once, even on different hosts.
+    A claim older than the lease time is assumed to belong to a worker that
+    died, and can be taken over by another worker.
+    """
+    ident = ShortText (primary=True)
+    claimed_by = ShortText ()
+    claimed_at = DateTime ()
+
+    def log_create (self):
+        pass
+
+    @classmethod
+    def claim (cls, worker, count, lease, *args, **kw):
+        """
+        Claim up to count unclaimed queued objects for worker.
+
+        Objects with a higher priority in Schedule are claimed first.
+
+        The lease is given in seconds.  Extra arguments are conditions on
+        Queue, used to restrict which objects are claimed.  The claims are
+        committed before returning, and the list of claimed idents is
+        returned.  If other workers keep taking the same objects, this
+        backs off and retries a few times, then returns None.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        for attempt in range (5):
+            now = datetime.datetime.utcnow ()
+            expired = now - datetime.timedelta (seconds=lease)
+            sel = store.using (LeftJoin (LeftJoin (Queue, QueueLease,
+                                                   Queue.ident == QueueLease.ident),
+                                         Schedule, Queue.ident == Schedule.ident))
+            sel = sel.find ((Queue.ident, QueueLease.ident),
+                            Or (QueueLease.ident == None,
+                                QueueLease.claimed_at < expired),
+                            *args)
+            sel.order_by (Desc (Coalesce (Schedule.priority, 0)))
+            sel.config (limit=count)
+            try:
+                claimed = []
+                newrows = []
+                for ident, leased in list(sel):
+                    if leased is None:
+                        newrows.append ({'ident': ident, 'claimed_by': worker,
+                                         'claimed_at': now})
+                        claimed.append (ident)
+                        continue
+                    # Only take over a lease if it's still expired, so two
+                    # workers can't both take over the same one.
+                    res = store.execute ('UPDATE %s SET claimed_by = ?, claimed_at = ?'
+                                         ' WHERE ident = ? AND claimed_at < ?'
+                                         % cls.__storm_table__,
+                                         (worker, now, ident, expired))
+                    if res.rowcount == 1:
+                        claimed.append (ident)
+                # Inserting a claim some other worker already made fails on
+                # the primary key, and we start over with fresh candidates.
+                cls.insert_many (newrows, __blip_store__=store)
+                # Commit and roll back on the store directly, so the buffers
+                # commit and rollback handle aren't written or thrown away.
+                if not store_options.get ('rollback', False):
+                    store.commit ()
+                return claimed
+            except storm.exceptions.IntegrityError:
+                store.rollback ()
+                # Another worker got there first.  Wait a little, longer
+                # each time, so the workers don't keep colliding.
+                time.sleep (random.uniform (0, 0.1 * 2 ** attempt))
+        blip.utils.warn ('Could not claim queue entries after %i conflicts' % (attempt + 1))
+        return None
+
+    @classmethod
+    def renew (cls, ident, worker, **kw):
+        """
+        Renew a claim made by worker, returning whether it still holds it.
+
+        The renewed claim is committed before returning.  A worker should
+        renew each claim right before processing the object, because a
+        claim that sat past its lease may have been taken over.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        res = store.execute ('UPDATE %s SET claimed_at = ?'
+                             ' WHERE ident = ? AND claimed_by = ?'
+                             % cls.__storm_table__,
+                             (datetime.datetime.utcnow (), ident, worker))
+        if not store_options.get ('rollback', False):
+            store.commit ()
+        return res.rowcount == 1
+
+    @classmethod
+    def release (cls, ident, worker, **kw):
+        """
+        Release a claim made by worker.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        store.find (cls, cls.ident == ident, cls.claimed_by == worker).remove ()
+
+
+class Schedule (BlipModel):
+    """
+    When a record should next be updated, and how much updating it matters.
+
+    Records with recent activity and high scores get a higher priority and
+    are due again sooner. Records that fail to update back off exponentially.
+    """
+    ident = ShortText (primary=True)
+    priority = Float ()
+    due = DateTime ()
+    updated = DateTime ()
+    failures = Int ()
+
+    # How long to wait before updating a record again, by the age in
+    # days of its latest activity.
+    intervals = ((7, datetime.timedelta (hours=6)),
+                 (30, datetime.timedelta (days=1)),
+                 (365, datetime.timedelta (days=7)),
+                 (None, datetime.timedelta (days=28)))
+    failure_interval = datetime.timedelta (hours=1)
+    failure_interval_max = datetime.timedelta (days=28)
+
+    def log_create (self):
+        pass
+
+    @classmethod
+    def set_result (cls, ident, score=None, activity=None, failed=False, **kw):
+        """
+        Schedule the next update for a record that was just updated.
+
+        The score and the datetime of the latest activity are used to set
+        the priority and due time. If the update failed, the record is
+        pushed back by an interval that doubles for each failure in a row.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        now = datetime.datetime.utcnow ()
+        sched = store.get (cls, ident)
+        if sched is None:
+            sched = cls (ident=ident, failures=0, __blip_store__=store)
+        sched.updated = now
+
+        # Records with no known activity are treated as a year old.
+        if activity is None:
+            age = 365
+        else:
+            age = max (0, (now - activity).days)
+        sched.priority = float (1 + (score or 0)) / (1 + age / 7.0)
+
+        if failed:
+            sched.failures = (sched.failures or 0) + 1
+            interval = cls.failure_interval * (2 ** min (sched.failures - 1, 16))
+            sched.due = now + min (interval, cls.failure_interval_max)
+        else:
+            sched.failures = 0
+            for days, interval in cls.intervals:
+                if days is None or age < days:
+                    sched.due = now + interval
+                    break
+        return sched
+
+    @classmethod
+    def get_schedules (cls, idents, **kw):
+        """
+        Get a dictionary mapping idents to their Schedule records.
+        """
+        store = get_store (kw.pop ('__blip_store__', cls.__blip_store__))
+        idents = list(idents)
+        ret = {}
+        for start in range (0, len(idents), 500):
+            for sched in store.find (cls, cls.ident.is_in (idents[start:start + 500])):
+                ret[sched.ident] = sched
+        return ret
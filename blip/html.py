@@ -393,10 +393,53 @@ class TabProvider (blip.web.ContentResponder):
     CORE_TAB = 10
     EXTRA_TAB = 20
 
+    # The first path components this provider adds tabs and responds for,
+    # or None for any
+    web_paths = None
+    web_queries = ('tab',)
+
+    _path_providers = {}
+
     @classmethod
     def add_tabs (cls, page, request):
         pass
 
+    @classmethod
+    def get_path_providers (cls, request):
+        """
+        Get the tab providers whose web_paths match the request path.
+        """
+        if len(request.path) > 0:
+            key = request.path[0]
+        else:
+            key = ''
+        providers = TabProvider._path_providers.get (key)
+        if providers is None:
+            providers = [provider for provider in TabProvider.get_extensions ()
+                         if provider.web_paths is None or key in provider.web_paths]
+            TabProvider._path_providers[key] = providers
+        return providers
+
+    @classmethod
+    def get_count (cls, request, name, func):
+        """
+        Get a count for a tab from the summary of the request's record.
+
+        The summary is looked up once for each request.  If the record has
+        no summary or the summary doesn't have the count, func is called to
+        count it directly.
+        """
+        counts = request.get_data ('record_summary', None)
+        if counts is None:
+            if request.record is not None:
+                counts = blip.db.RecordSummary.get_counts (request.record.ident)
+            if counts is None:
+                counts = {}
+            request.set_data ('record_summary', counts)
+        if counts.has_key (name):
+            return counts[name]
+        return func ()
+
     @classmethod
     def match_tab (cls, request, tabid):
         if request.query.get ('q', None) != 'tab':
@@ -461,7 +504,7 @@ class Page (HtmlObject, ContentComponent):
         if request is not None:
             if self._url is None:
                 self._url = blinq.config.web_root_url + '/'.join(request.path)
-            for provider in TabProvider.get_extensions ():
+            for provider in TabProvider.get_path_providers (request):
                 provider.add_tabs (self, request)
             for provider in HeaderLinksProvider.get_extensions ():
                 provider.add_header_links (self, request)
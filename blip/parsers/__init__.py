@@ -18,13 +18,116 @@
 # Suite 330, Boston, MA  0211-1307  USA.
 #
 
+"""
+Parsers for files in source code repositories.
+
+Parsed files are cached by parser class, parser version, and a digest
+of the file contents, first in a bounded in-memory cache, then on disk
+in cache_dir. Identical files on different branches share an entry.
+Parser classes set parser_version, which must be bumped whenever the
+parser changes what it extracts. Parsers whose results depend on more
+than the file contents can define get_cache_data to return a string
+with everything else they depend on.
+"""
+
+import cPickle
+import hashlib
+import os
+import tempfile
+
+import blinq.config
+
+import blip.utils
+
+# How many parsed files to keep in memory
+memory_cache_size = 200
+
 _parsed_files = {}
+_parsed_files_tick = 0
 
 def get_parsed_file (cls, record, filename):
-    ret = _parsed_files.get ((cls, record.ident, filename))
-    if ret is not None:
-        return ret
+    global _parsed_files_tick
+    key = get_cache_key (cls, record, filename)
+    _parsed_files_tick += 1
+
+    cached = _parsed_files.get (key)
+    if cached is not None:
+        cached[1] = _parsed_files_tick
+        return cached[0]
+
+    ret = _read_cache_file (cls, key)
+    if ret is None:
+        ret = cls (record, filename)
+        _write_cache_file (cls, key, ret)
 
-    ret = cls (record, filename)
-    _parsed_files[(cls, record.ident, filename)] = ret
+    if len(_parsed_files) >= memory_cache_size:
+        # Drop the least recently used half in one go, so we don't
+        # have to keep the entries sorted.
+        ticks = sorted ([val[1] for val in _parsed_files.values ()])
+        cutoff = ticks[len(ticks) // 2]
+        for oldkey in _parsed_files.keys ():
+            if _parsed_files[oldkey][1] <= cutoff:
+                del _parsed_files[oldkey]
+    _parsed_files[key] = [ret, _parsed_files_tick]
     return ret
+
+
+def get_cache_key (cls, record, filename):
+    """
+    Get the cache key for a file parsed with a parser class.
+    """
+    digest = hashlib.sha1 ()
+    digest.update ('%s.%s:%s\0' % (cls.__module__, cls.__name__,
+                                   getattr (cls, 'parser_version', 0)))
+    get_cache_data = getattr (cls, 'get_cache_data', None)
+    if get_cache_data is not None:
+        digest.update (blip.utils.utf8enc (get_cache_data (record, filename)))
+        digest.update ('\0')
+    fd = open (filename, 'rb')
+    try:
+        buf = fd.read (65536)
+        while buf:
+            digest.update (buf)
+            buf = fd.read (65536)
+    finally:
+        fd.close ()
+    return digest.hexdigest ()
+
+
+def _get_cache_file (cls, key):
+    return os.path.join (blinq.config.cache_dir, 'parsers',
+                         cls.__name__, key[:2], key[2:] + '.pickle')
+
+
+def _read_cache_file (cls, key):
+    cachefile = _get_cache_file (cls, key)
+    if not os.path.exists (cachefile):
+        return None
+    try:
+        fd = open (cachefile, 'rb')
+        try:
+            return cPickle.load (fd)
+        finally:
+            fd.close ()
+    except:
+        blip.utils.warn ('Could not read parser cache file %s' % cachefile)
+        return None
+
+
+def _write_cache_file (cls, key, parsed):
+    cachefile = _get_cache_file (cls, key)
+    try:
+        dirname = os.path.dirname (cachefile)
+        if not os.path.exists (dirname):
+            os.makedirs (dirname)
+        # Write to a temporary file and rename it, so that concurrent
+        # sweeps never see a partial cache file.
+        (fdnum, tmp) = tempfile.mkstemp (dir=dirname)
+        fd = os.fdopen (fdnum, 'wb')
+        try:
+            cPickle.dump (parsed, fd, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            fd.close ()
+        os.rename (tmp, cachefile)
+    except:
+        blip.utils.warn ('Could not write parser cache file %s' % cachefile)
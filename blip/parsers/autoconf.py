@@ -18,27 +18,172 @@
 # Suite 330, Boston, MA  0211-1307  USA.
 #
 
-import commands
 import fnmatch
+import hashlib
 import os
 import re
+import subprocess
+import tempfile
+import threading
+
+import blinq.config
+
+import blip.utils
+
+# How many autoconf outputs to keep in cache_dir
+disk_cache_size = 2000
 
 class Autoconf (object):
     """
     Parse a configure.ac file.
     """
+    parser_version = 1
 
-    def __init__ (self, record, filename):
+    @staticmethod
+    def get_cache_data (record, filename):
+        data = Autoconf.get_macro_digest (filename)
+        if record is not None:
+            data += '\0' + blip.utils.utf8enc (record.data.get ('configure_args', ''))
+        return data
+
+    @staticmethod
+    def get_macro_files (filename):
+        """
+        Get the m4 files a configure file might pull macros from.
+        """
+        dirname = os.path.dirname (filename)
+        macrodirs = []
+        files = []
+        fd = open (filename)
+        try:
+            for line in fd:
+                for (macro, isdir) in (('m4_include(', False),
+                                       ('m4_sinclude(', False),
+                                       ('sinclude(', False),
+                                       ('AC_CONFIG_MACRO_DIR(', True)):
+                    idx = line.find (macro)
+                    if idx < 0:
+                        continue
+                    arg = line[idx + len(macro):].split (')')[0].strip ().strip ('[]')
+                    if arg == '':
+                        continue
+                    if isdir:
+                        macrodirs.append (os.path.join (dirname, arg))
+                    else:
+                        files.append (os.path.join (dirname, arg))
+        finally:
+            fd.close ()
+        for name in ('aclocal.m4', 'acinclude.m4'):
+            files.append (os.path.join (dirname, name))
+        for macrodir in macrodirs:
+            if os.path.isdir (macrodir):
+                files.extend ([os.path.join (macrodir, name)
+                               for name in os.listdir (macrodir)
+                               if name.endswith ('.m4')])
+        return sorted ([fname for fname in set(files) if os.path.isfile (fname)])
+
+    @staticmethod
+    def get_macro_digest (filename):
+        """
+        Get a digest of the m4 files a configure file might pull macros from.
+        """
+        digest = hashlib.sha1 ()
+        dirname = os.path.dirname (filename)
+        for fname in Autoconf.get_macro_files (filename):
+            digest.update (os.path.relpath (fname, dirname) + '\0')
+            fd = open (fname, 'rb')
+            try:
+                digest.update (fd.read ())
+            finally:
+                fd.close ()
+            digest.update ('\0')
+        return digest.hexdigest ()
+
+    @staticmethod
+    def get_expanded (record, filename):
+        """
+        Get the output of autoconf for a configure file.
+
+        The output is cached in cache_dir, keyed by the contents of the
+        configure file and its m4 files and the configure arguments, so
+        autoconf only runs when one of those has changed.  If autoconf
+        fails or runs longer than autoconf_timeout, the contents of the
+        configure file itself are returned, and the failure is cached
+        under the same key so autoconf isn't run again on the same input.
+        """
+        digest = hashlib.sha1 ()
+        digest.update (Autoconf.get_cache_data (record, filename) + '\0')
+        fd = open (filename, 'rb')
+        try:
+            digest.update (fd.read ())
+        finally:
+            fd.close ()
+        key = digest.hexdigest ()
+        cachefile = os.path.join (blinq.config.cache_dir, 'autoconf',
+                                  key[:2], key[2:])
+        failfile = cachefile + '.failed'
+        for fname in (cachefile, failfile):
+            if not os.path.exists (fname):
+                continue
+            try:
+                fd = open (fname, 'rb')
+                try:
+                    output = fd.read ()
+                finally:
+                    fd.close ()
+                # Bump the time so pruning drops the least recently used.
+                os.utime (fname, None)
+            except:
+                blip.utils.warn ('Could not read autoconf cache file %s' % fname)
+                continue
+            if fname == failfile:
+                return open(filename).read()
+            return output
+
+        try:
+            output = Autoconf.run_autoconf (filename)
+        except OSError:
+            # No autoconf here.  Don't remember that, since it may be
+            # installed later.
+            return open(filename).read()
+        if output is None:
+            _write_cache_file (failfile, '')
+            return open(filename).read()
+        _write_cache_file (cachefile, output)
+        return output
+
+    @staticmethod
+    def run_autoconf (filename):
+        """
+        Run autoconf on a configure file, returning None on failure.
+
+        This raises OSError if autoconf can't be run at all.
+        """
         dirname = os.path.dirname (filename)
         basename = os.path.basename (filename)
-        owd = os.getcwd ()
+        devnull = open (os.devnull, 'w')
+        try:
+            proc = subprocess.Popen (['autoconf', basename], cwd=dirname,
+                                     stdout=subprocess.PIPE, stderr=devnull)
+        finally:
+            devnull.close ()
+        timer = threading.Timer (blinq.config.autoconf_timeout, proc.kill)
+        timer.start ()
         try:
-            os.chdir (dirname)
-            (status, output) = commands.getstatusoutput ('autoconf "%s" 2>/dev/null' % basename)
+            output = proc.communicate ()[0]
         finally:
-            os.chdir (owd)
-        if status != 256:
-            output = open(filename).read()
+            timer.cancel ()
+        # autoconf exits with 1 when it can't expand some macros, which
+        # is normal here, since we don't run aclocal first.
+        if proc.returncode in (0, 1):
+            return output
+        if proc.returncode < 0:
+            blip.utils.warn ('Killed autoconf on %s after %i seconds'
+                             % (filename, blinq.config.autoconf_timeout))
+        return None
+
+    def __init__ (self, record, filename):
+        output = Autoconf.get_expanded (record, filename)
         self._vars = {}
         self._functxts = {}
         self._funcargs = {}
@@ -173,3 +318,47 @@ class Autoconf (object):
 
     def get_package_version (self):
         return self._pkgversion
+
+
+def _write_cache_file (cachefile, output):
+    try:
+        dirname = os.path.dirname (cachefile)
+        if not os.path.exists (dirname):
+            os.makedirs (dirname)
+        (fdnum, tmp) = tempfile.mkstemp (dir=dirname)
+        fd = os.fdopen (fdnum, 'wb')
+        try:
+            fd.write (output)
+        finally:
+            fd.close ()
+        os.rename (tmp, cachefile)
+    except:
+        blip.utils.warn ('Could not write autoconf cache file %s' % cachefile)
+        return
+    _prune_cache_files ()
+
+
+def _prune_cache_files ():
+    """
+    Keep the autoconf cache from growing past disk_cache_size files.
+    """
+    topdir = os.path.join (blinq.config.cache_dir, 'autoconf')
+    files = []
+    for dirname, dirnames, basenames in os.walk (topdir):
+        files.extend ([os.path.join (dirname, basename) for basename in basenames])
+    if len(files) <= disk_cache_size:
+        return
+    # Drop the least recently used half in one go, so we don't have to
+    # look at the whole cache every time something is written.
+    times = []
+    for fname in files:
+        try:
+            times.append ((os.path.getmtime (fname), fname))
+        except OSError:
+            pass
+    times.sort ()
+    for mtime, fname in times[:len(times) // 2]:
+        try:
+            os.remove (fname)
+        except OSError:
+            pass
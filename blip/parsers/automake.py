@@ -32,6 +32,7 @@ class Automake (object):
     from them.  Directives for make are ignored.  This is only useful for
     extracting variables.
     """
+    parser_version = 1
 
     def __init__ (self, record, filename):
         self._variables = {}
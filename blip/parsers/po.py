@@ -18,6 +18,7 @@
 # Suite 330, Boston, MA  0211-1307  USA.
 #
 
+import codecs
 import re
 
 import blip.utils
@@ -31,6 +32,7 @@ class Po (object):
     the file.  Otherwise, you must manually pass data to the feed method
     and call the finish method when you're done.
     """
+    parser_version = 1
 
     def __init__ (self, record, fd=None):
         if isinstance (fd, basestring):
@@ -57,6 +59,11 @@ class Po (object):
                 self.feed (line)
             self.finish ()
 
+    def __getstate__ (self):
+        state = self.__dict__.copy ()
+        state['_fd'] = None
+        return state
+
     def feed (self, line):
         """Pass a line of data to the parser."""
         line = line.strip()
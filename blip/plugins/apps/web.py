@@ -29,6 +29,8 @@ import blip.utils
 import blip.plugins.modules.web
 
 class ApplicationResponder (blip.web.RecordLocator, blip.web.PageResponder):
+    web_paths = ('app',)
+
     @classmethod
     def locate_record (cls, request):
         if len(request.path) not in (4, 5) or request.path[0] != 'app':
@@ -83,6 +85,8 @@ class ApplicationResponder (blip.web.RecordLocator, blip.web.PageResponder):
         return response
 
 class OverviewTab (blip.html.TabProvider):
+    web_paths = ('app',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) < 1 or request.path[0] != 'app':
@@ -147,6 +151,8 @@ class OverviewTab (blip.html.TabProvider):
         return response
 
 class ApplicationsTab (blip.html.TabProvider):
+    web_paths = ('mod', 'set')
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) < 1:
@@ -161,7 +167,7 @@ class ApplicationsTab (blip.html.TabProvider):
                                           parent_in_set=request.record)
         else:
             return None
-        cnt = apps.count ()
+        cnt = cls.get_count (request, 'apps', apps.count)
         if cnt > 0:
             page.add_tab ('apps',
                           blip.utils.gettext ('Applications (%i)') % cnt,
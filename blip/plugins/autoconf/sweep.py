@@ -38,6 +38,8 @@ class AutoconfHandler (blip.plugins.modules.sweep.ModuleFileScanner):
     """
     ModuleScanner plugin for module configuration files.
     """
+    file_basenames = ('configure.in', 'configure.ac')
+    file_depth = 0
 
     def process_file (self, dirname, basename):
         """
@@ -49,7 +51,9 @@ class AutoconfHandler (blip.plugins.modules.sweep.ModuleFileScanner):
             return
 
         filename = os.path.join (dirname, basename)
-        with blip.db.Timestamp.stamped (filename, self.scanner.repository) as stamp:
+        sourcefunc = blip.db.get_sourcefunc (AutoconfHandler.process_file)
+        with blip.db.Timestamp.stamped (filename, self.scanner.repository,
+                                        sourcefunc=sourcefunc) as stamp:
             stamp.check (self.scanner.request.get_tool_option ('timestamps'))
             stamp.log ()
 
@@ -69,6 +69,8 @@ class CommitMessageFormatter (blip.plugins.home.web.MessageFormatter):
         return None
 
 class CommitsTab (blip.html.TabProvider):
+    web_paths = ('mod', 'person')
+
     @classmethod
     def add_tabs (cls, page, request):
         if request.record is None:
@@ -79,7 +81,8 @@ class CommitsTab (blip.html.TabProvider):
         elif isinstance (request.record, blip.db.Entity) and request.record.type == u'Person':
             # But people could exist for all sorts of reason that
             # don't involve having commits.
-            cnt = blip.db.Revision.select (person=request.record).count ()
+            cnt = cls.get_count (request, 'commits',
+                                 lambda: blip.db.Revision.select (person=request.record).count ())
         else:
             cnt = 0
         if cnt > 0:
@@ -101,18 +104,10 @@ class CommitsTab (blip.html.TabProvider):
         response = blip.web.WebResponse (request)
         tab = blip.html.PaddingBox ()
 
-        store = blip.db.get_store (blip.db.Revision)
         if isinstance (request.record, blip.db.Branch):
-            sel = store.using (blip.db.Revision,
-                               blip.db.Join (blip.db.RevisionBranch,
-                                             blip.db.RevisionBranch.revision_ident == blip.db.Revision.ident))
-            sel = sel.find ((blip.db.Revision.weeknum, blip.db.Count('*')),
-                            blip.db.RevisionBranch.branch_ident == request.record.ident)
+            sel = blip.db.ActivityWeek.get_counts (request.record.ident, u'branch')
         else:
-            sel = store.find ((blip.db.Revision.weeknum, blip.db.Count('*')),
-                              blip.db.Revision.person_ident == request.record.ident)
-        sel = sel.group_by (blip.db.Revision.weeknum)
-        sel = sel.order_by (blip.db.Revision.weeknum)
+            sel = blip.db.ActivityWeek.get_counts (request.record.ident, u'person')
 
         graph = blip.html.BarGraph ()
         tab.add_content (graph)
@@ -229,6 +224,8 @@ class CommitsTab (blip.html.TabProvider):
 
 
 class CommitsGraphMap (blip.web.ContentResponder):
+    web_queries = ('graphmap',)
+
     @classmethod
     def respond (cls, request):
         if request.record is None:
@@ -262,6 +259,8 @@ class CommitsGraphMap (blip.web.ContentResponder):
 
 
 class CommitsDiv (blip.web.ContentResponder):
+    web_queries = ('commits',)
+
     @classmethod
     def respond (cls, request):
         if request.record is None:
@@ -327,6 +326,8 @@ class CommitsDiv (blip.web.ContentResponder):
 
 
 class ModuleSparkResponder (blip.web.DataResponder):
+    web_queries = ('spark',)
+
     @classmethod
     def respond (cls, request):
         if request.query.get ('d', None) != 'spark':
@@ -343,19 +344,12 @@ class ModuleSparkResponder (blip.web.DataResponder):
         response.payload = json
 
         thisweek = blip.utils.weeknum()
-        store = blip.db.get_store (blip.db.Revision)
         if isinstance (request.record, blip.db.Branch):
-            sel = store.using (blip.db.Revision,
-                               blip.db.Join (blip.db.RevisionBranch,
-                                             blip.db.RevisionBranch.revision_ident == blip.db.Revision.ident))
-            sel = sel.find ((blip.db.Revision.weeknum, blip.db.Count('*')),
-                            blip.db.RevisionBranch.branch_ident == request.record.ident,
-                            blip.db.Revision.weeknum > (thisweek - 208))
+            kind = u'branch'
         else:
-            sel = store.find ((blip.db.Revision.weeknum, blip.db.Count('*')),
-                              blip.db.Revision.person_ident == request.record.ident,
-                              blip.db.Revision.weeknum > (thisweek - 208))
-        sel = sel.group_by (blip.db.Revision.weeknum)
+            kind = u'person'
+        sel = blip.db.ActivityWeek.get_counts (request.record.ident, kind,
+                                               blip.db.ActivityWeek.weeknum > (thisweek - 208))
         stats = [0 for i in range(208)]
         for week, cnt in list(sel):
             stats[week - (thisweek - 207)] = cnt
@@ -0,0 +1,297 @@
+# Copyright (c) 2006-2010  Shaun McCance  <shaunm@gnome.org>
+#
+# This file is part of Blip, a program for displaying various statistics
+# of questionable relevance about software and the people who make it.
+#
+# Blip is free software; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# Blip is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Blip; if not, write to the Free Software Foundation, 59 Temple Place,
+# Suite 330, Boston, MA  0211-1307  USA.
+#
+
+"""
+Run sweep commands on schedules in one long-running process
+"""
+
+import optparse
+import os
+import select
+import socket
+import time
+
+import blinq.config
+
+import blip.db
+import blip.scm
+import blip.sweep
+import blip.utils
+
+
+class DaemonOptionParser (optparse.OptionParser):
+    def error (self, msg):
+        raise ValueError (msg)
+
+
+class DaemonRequest (object):
+    """
+    A request to run a sweep command inside the daemon.
+
+    This provides the parts of the command line request that responders
+    use, with the tool options parsed from a list of arguments.  Common
+    options come from the request that started the daemon.
+    """
+
+    def __init__ (self, request, responder, argv):
+        self._request = request
+        self._parser = DaemonOptionParser (add_help_option=False)
+        responder.add_tool_options (self)
+        (self._options, self._args) = self._parser.parse_args (argv)
+
+    def set_usage (self, usage):
+        self._parser.set_usage (usage)
+
+    def add_tool_option (self, *args, **kw):
+        self._parser.add_option (*args, **kw)
+
+    def get_tool_option (self, option, default=None):
+        value = getattr (self._options, option, None)
+        if value is None:
+            return default
+        return value
+
+    def get_tool_args (self):
+        return self._args
+
+    def get_common_option (self, option):
+        return self._request.get_common_option (option)
+
+
+class DaemonResponder (blip.sweep.SweepResponder):
+    command = 'daemon'
+    synopsis = 'run sweep commands on schedules in one long-running process'
+
+    # Commands to run, and how often to run them in seconds
+    schedules = ((('queue', '--time-limit', '600'), 300),
+                 (('modules', '--scheduled', '--time-limit', '1800'), 900),
+                 (('people', '--until', '86400'), 3600),
+                 (('lists',), 3600),
+                 (('scores',), 86400))
+
+    # Commands to run when files in input_dir change
+    input_files = (('sets.xml', ('sets',)),
+                   ('teams.xml', ('teams',)),
+                   ('lists.xml', ('lists',)))
+
+    @classmethod
+    def set_usage (cls, request):
+        request.set_usage ('%prog [common options] daemon [command options]')
+
+    @classmethod
+    def add_tool_options (cls, request):
+        request.add_tool_option ('--socket',
+                                 dest='daemon_socket',
+                                 metavar='FILE',
+                                 help='listen for commands on the socket FILE')
+        request.add_tool_option ('--poll',
+                                 dest='daemon_poll',
+                                 metavar='SECONDS',
+                                 help='check input files every SECONDS seconds (default 60)')
+        request.add_tool_option ('--every',
+                                 dest='daemon_every',
+                                 action='append',
+                                 metavar='COMMAND=SECONDS',
+                                 help='run the scheduled COMMAND every SECONDS seconds, or never if 0')
+
+    @classmethod
+    def respond (cls, request):
+        response = blip.sweep.SweepResponse (request)
+
+        scheduled = [argv[0] for argv, interval in cls.schedules]
+        intervals = {}
+        for every in (request.get_tool_option ('daemon_every') or []):
+            (command, sep, seconds) = every.partition ('=')
+            if command not in scheduled:
+                response.set_error (1, 'The --every option must name one of %s'
+                                    % ', '.join (scheduled))
+                return response
+            try:
+                seconds = int(seconds)
+            except ValueError:
+                seconds = -1
+            if seconds < 0:
+                response.set_error (1, 'The --every option must be COMMAND=SECONDS'
+                                    ' with SECONDS a number of at least 0')
+                return response
+            intervals[command] = seconds
+        now = time.time ()
+        # Each scheduled command is [argv, interval, next run time]
+        schedules = []
+        for argv, interval in cls.schedules:
+            interval = intervals.get (argv[0], interval)
+            if interval > 0:
+                schedules.append ([list(argv), interval, now])
+
+        poll = request.get_tool_option ('daemon_poll')
+        if poll is None:
+            poll = 60
+        else:
+            try:
+                poll = int(poll)
+            except ValueError:
+                poll = 0
+            if poll < 1:
+                response.set_error (1, 'The --poll option must be a number of at least 1')
+                return response
+        nextpoll = now
+        mtimes = {}
+        for basename, argv in cls.input_files:
+            mtimes[basename] = cls.get_mtime (basename)
+
+        sockfile = request.get_tool_option ('daemon_socket')
+        if sockfile is None:
+            sockfile = os.path.join (blinq.config.tmp_dir, 'blip-sweep.sock')
+        sock = cls.open_socket (sockfile)
+
+        pending = []
+        try:
+            while True:
+                now = time.time ()
+                if now >= nextpoll:
+                    for basename, argv in cls.input_files:
+                        mtime = cls.get_mtime (basename)
+                        if mtime != mtimes[basename]:
+                            mtimes[basename] = mtime
+                            if mtime is not None:
+                                blip.utils.log ('Input file %s changed' % basename)
+                                pending.append (list(argv))
+                    nextpoll = now + poll
+                for sched in schedules:
+                    if now >= sched[2]:
+                        pending.append (sched[0])
+                        sched[2] = now + sched[1]
+
+                # Commands from the socket go to the front of the line,
+                # so check for them between every two commands.
+                while len(pending) > 0:
+                    cls.read_socket (sock, pending, 0)
+                    cls.run_command (request, pending.pop (0))
+
+                timeout = min ([nextpoll] + [sched[2] for sched in schedules]) - time.time ()
+                cls.read_socket (sock, pending, max (0, timeout))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sock.close ()
+            if os.path.exists (sockfile):
+                os.remove (sockfile)
+
+        return response
+
+    @classmethod
+    def get_mtime (cls, basename):
+        try:
+            return os.stat (os.path.join (blinq.config.input_dir, basename)).st_mtime
+        except OSError:
+            return None
+
+    @classmethod
+    def open_socket (cls, sockfile):
+        """
+        Listen on the control socket, which only our own user can use.
+
+        Anyone who can connect can queue commands, so the socket is made
+        with mode 0600, and a missing directory is made with mode 0700.
+        """
+        dirname = os.path.dirname (sockfile)
+        if not os.path.exists (dirname):
+            os.makedirs (dirname, 0700)
+        if os.path.exists (sockfile):
+            os.remove (sockfile)
+        sock = socket.socket (socket.AF_UNIX, socket.SOCK_STREAM)
+        # Set the umask while binding, so the socket is never open to
+        # others, even for a moment.
+        umask = os.umask (0177)
+        try:
+            sock.bind (sockfile)
+        finally:
+            os.umask (umask)
+        os.chmod (sockfile, 0600)
+        sock.listen (5)
+        return sock
+
+    @classmethod
+    def read_socket (cls, sock, pending, timeout):
+        """
+        Wait up to timeout seconds for commands on the control socket.
+
+        Each connection sends one line, which is either a sweep command
+        with its options and arguments, or an ident to update through
+        the queue.  Commands are put at the front of pending.
+        """
+        (readable, writable, errored) = select.select ([sock], [], [], timeout)
+        commands = []
+        while len(readable) > 0:
+            (conn, addr) = sock.accept ()
+            try:
+                conn.settimeout (10)
+                line = ''
+                while not line.endswith ('\n'):
+                    data = conn.recv (4096)
+                    if data == '':
+                        break
+                    line += data
+                argv = line.split ()
+                if len(argv) == 0:
+                    conn.sendall ('error: no command\n')
+                elif argv[0].startswith ('/'):
+                    for ident in argv:
+                        blip.db.Queue.push (blip.utils.utf8dec (ident))
+                    blip.db.commit ()
+                    commands.append (['queue'] + argv)
+                    conn.sendall ('queued\n')
+                elif cls.get_responder (argv[0]) is None:
+                    conn.sendall ('error: unknown command %s\n' % argv[0])
+                else:
+                    commands.append (argv)
+                    conn.sendall ('queued\n')
+            except Exception, err:
+                blip.utils.warn ('Could not read command: %s' % err)
+            finally:
+                conn.close ()
+            (readable, writable, errored) = select.select ([sock], [], [], 0)
+        pending[0:0] = commands
+
+    @classmethod
+    def get_responder (cls, command):
+        for responder in blip.sweep.SweepResponder.get_extensions ():
+            if responder.command == command and responder is not cls:
+                return responder
+        return None
+
+    @classmethod
+    def run_command (cls, request, argv):
+        """
+        Run a sweep command in this process.
+        """
+        responder = cls.get_responder (argv[0])
+        if responder is None:
+            blip.utils.warn ('Unknown command %s' % argv[0])
+            return
+        blip.utils.log ('Running %s' % ' '.join (argv))
+        # Repositories are cached for the life of the process, and cached
+        # repositories are never updated again, so start each command fresh.
+        blip.scm.Repository.clear_cache ()
+        try:
+            responder.respond (DaemonRequest (request, responder, argv[1:]))
+        except Exception, err:
+            blip.db.rollback ()
+            blip.utils.warn ('Command %s failed: %s' % (' '.join (argv), err))
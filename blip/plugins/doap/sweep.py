@@ -79,6 +79,9 @@ class DefaultDoapHandler (DoapHandler):
 
 
 class DoapScanner (blip.plugins.modules.sweep.ModuleFileScanner):
+    file_globs = ('*.doap',)
+    file_depth = 0
+
     def __init__ (self, scanner):
         blip.plugins.modules.sweep.ModuleFileScanner.__init__ (self, scanner)
         self.doap_handlers = [handler(self.scanner) for handler in DoapHandler.get_extensions()]
@@ -89,8 +92,11 @@ class DoapScanner (blip.plugins.modules.sweep.ModuleFileScanner):
                  (self.scanner.branch.scm_path is not None and
                   basename == self.scanner.branch.scm_path + '.doap'))):
             filename = os.path.join (dirname, basename)
-            with blip.db.Error.catch (self.scanner.branch, 'Invalid DOAP file'):
-                with blip.db.Timestamp.stamped (filename, self.scanner.repository) as stamp:
+            sourcefunc = blip.db.get_sourcefunc (DoapScanner.process_file)
+            with blip.db.Error.catch (self.scanner.branch, 'Invalid DOAP file',
+                                      sourcefunc=sourcefunc):
+                with blip.db.Timestamp.stamped (filename, self.scanner.repository,
+                                                sourcefunc=sourcefunc) as stamp:
                     stamp.check (self.scanner.request.get_tool_option ('timestamps'))
                     stamp.log ()
                     model = RDF.Model()
@@ -31,6 +31,8 @@ import blip.utils
 import blip.plugins.modules.web
 
 class DocumentResponder (blip.web.RecordLocator, blip.web.PageResponder):
+    web_paths = ('doc', 'page')
+
     @classmethod
     def locate_record (cls, request):
         if not ((len(request.path) in (4, 5) and request.path[0] == 'doc') or
@@ -93,6 +95,8 @@ class DocumentResponder (blip.web.RecordLocator, blip.web.PageResponder):
         return response
 
 class OverviewTab (blip.html.TabProvider):
+    web_paths = ('doc', 'page')
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) < 1 or request.path[0] not in ('doc', 'page'):
@@ -197,6 +201,8 @@ class OverviewTab (blip.html.TabProvider):
         return response
 
 class DevelopersTab (blip.html.TabProvider):
+    web_paths = ('doc', 'page')
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) < 1 or request.path[0] not in ('doc', 'page'):
@@ -205,7 +211,8 @@ class DevelopersTab (blip.html.TabProvider):
                 (request.record.type == u'Document' or
                  request.record.type == u'DocumentPage')):
             return None
-        cnt = blip.db.DocumentEntity.count_related (subj=request.record)
+        cnt = cls.get_count (request, 'developers',
+                             lambda: blip.db.DocumentEntity.count_related (subj=request.record))
         if cnt > 0:
             page.add_tab ('developers',
                           blip.utils.gettext ('Developers (%i)') % cnt,
@@ -234,6 +241,8 @@ class DevelopersTab (blip.html.TabProvider):
         return response
 
 class FilesTab (blip.html.TabProvider):
+    web_paths = ('doc',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) < 1 or request.path[0] != 'doc':
@@ -272,6 +281,8 @@ class FilesTab (blip.html.TabProvider):
         return response
 
 class PagesTab (blip.html.TabProvider):
+    web_paths = ('doc',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) < 1 or request.path[0] != 'doc':
@@ -279,7 +290,8 @@ class PagesTab (blip.html.TabProvider):
         if not (isinstance (request.record, blip.db.Branch) and
                 request.record.type == u'Document'):
             return None
-        cnt = request.record.select_children (u'DocumentPage').count ()
+        cnt = cls.get_count (request, 'pages',
+                             request.record.select_children (u'DocumentPage').count)
         if cnt > 0:
             page.add_tab ('pages',
                           blip.utils.gettext ('Pages (%i)') % cnt,
@@ -332,6 +344,8 @@ class PagesTab (blip.html.TabProvider):
         return response
 
 class DocumentsTab (blip.html.TabProvider):
+    web_paths = ('mod', 'set')
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) < 1:
@@ -346,7 +360,7 @@ class DocumentsTab (blip.html.TabProvider):
                                           parent_in_set=request.record)
         else:
             return None
-        cnt = docs.count ()
+        cnt = cls.get_count (request, 'docs', docs.count)
         if cnt > 0:
             page.add_tab ('docs',
                           blip.utils.gettext ('Documents (%i)') % cnt,
@@ -117,41 +117,45 @@ class PeopleResponder (blip.sweep.SweepResponder,
             handler.handle_entity (entity, request)
         cls.update_score (entity)
         entity.updated = datetime.datetime.utcnow ()
+        blip.db.CacheVersion.bump (entity.ident)
+        blip.db.RecordSummary.touch (entity)
         blip.db.Queue.pop (entity.ident)
 
     @classmethod
     def update_score (cls, entity):
-        store = blip.db.get_store (blip.db.Revision)
         thisweek = blip.utils.weeknum()
-        sel = store.find ((blip.db.Revision.weeknum, blip.db.Count('*')),
-                          blip.db.And (blip.db.Revision.person_ident == entity.ident,
-                                       blip.db.Revision.weeknum > thisweek - 26,
-                                       blip.db.Revision.weeknum <= thisweek))
-        sel = sel.group_by (blip.db.Revision.weeknum)
+        blip.db.ActivityWeek.flush_counts ()
+        sel = blip.db.ActivityWeek.get_counts (entity.ident, u'person',
+                                               blip.db.ActivityWeek.weeknum > thisweek - 26,
+                                               blip.db.ActivityWeek.weeknum <= thisweek)
         stats = [0 for i in range(26)]
         for week, cnt in list(sel):
             stats[week - (thisweek - 25)] = cnt
-        entity.score = blip.utils.score (stats)
-
-        stats = stats[:-3]
-        avg = int(round(sum(stats) / (len(stats) * 1.0)))
-        stats = stats + [avg, avg, avg]
-        old = blip.utils.score (stats)
-        entity.score_diff = entity.score - old
+        (entity.score, entity.score_diff) = blip.utils.score_with_diff (stats)
 
 
     @classmethod
     def update_scores (cls, request, ident):
+        store = blip.db.get_store (blip.db.Revision)
+        thisweek = blip.utils.weeknum()
+        args = [blip.db.Entity.type == u'Person']
+        weekargs = [blip.db.ActivityWeek.weeknum > thisweek - 26,
+                    blip.db.ActivityWeek.weeknum <= thisweek]
         if ident is not None:
-            ents = list(blip.db.Entity.select (blip.db.Entity.type == u'Person',
-                                               blip.db.Entity.ident.like (ident),
-                                               blip.db.Entity.score > 0))
-        else:
-            ents = list(blip.db.Entity.select (blip.db.Entity.type == u'Person',
-                                               blip.db.Entity.score > 0))
-        for ent in ents:
-            blip.utils.log ('Updating score for ' + ent.ident)
-            cls.update_score (ent)
+            args.append (blip.db.Entity.ident.like (ident))
+            weekargs.append (blip.db.ActivityWeek.owner_ident.like (ident))
+        blip.utils.log ('Updating scores for people')
+        blip.db.ActivityWeek.flush_counts ()
+        counts = blip.db.ActivityWeek.select_counts (u'person', *weekargs)
+        current = store.find ((blip.db.Entity.ident,
+                               blip.db.Entity.score,
+                               blip.db.Entity.score_diff),
+                              *args)
+        cls.set_scores (blip.db.Entity, list(counts), list(current))
+
+        ranks = store.find ((blip.db.Entity.ident, blip.db.Entity.score),
+                            blip.db.Entity.type == u'Person')
+        blip.db.ScoreRank.set_ranks (u'person', list(ranks))
 
     @classmethod
     def process_queued (cls, ident, request):
@@ -258,7 +262,6 @@ class TeamsResponder (blip.sweep.SweepResponder,
                 subteams = []
                 for subteam in datum.get ('team', {}).values ():
                     ent = process_team_datum (subteam)
-                    ent.parent = team
                     subteams.append (ent)
                 team.set_children (u'Team', subteams)
 
@@ -280,6 +283,8 @@ class TeamsResponder (blip.sweep.SweepResponder,
             handler.handle_entity (entity, request)
 
         entity.updated = datetime.datetime.utcnow ()
+        blip.db.CacheVersion.bump (entity.ident)
+        blip.db.RecordSummary.touch (entity)
         blip.db.Queue.pop (entity.ident)
 
     @classmethod
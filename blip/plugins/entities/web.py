@@ -36,6 +36,8 @@ import blip.plugins.index.web
 ## Pages
 
 class AllPeopleResponder (blip.web.RecordLocator, blip.web.PageResponder):
+    web_paths = ('person',)
+
     @classmethod
     def locate_record (cls, request):
         if len(request.path) == 1 and request.path[0] == 'person':
@@ -65,6 +67,8 @@ class AllPeopleResponder (blip.web.RecordLocator, blip.web.PageResponder):
         return response
 
 class AllTeamsResponder (blip.web.RecordLocator, blip.web.PageResponder):
+    web_paths = ('team',)
+
     @classmethod
     def locate_record (cls, request):
         if len(request.path) == 1 and request.path[0] == 'team':
@@ -102,6 +106,8 @@ class AllTeamsResponder (blip.web.RecordLocator, blip.web.PageResponder):
 
 
 class EntityReponder (blip.web.RecordLocator, blip.web.PageResponder):
+    web_paths = ('person', 'team')
+
     @classmethod
     def locate_record (cls, request):
         if len(request.path) != 2 or request.path[0] not in ('person', 'team'):
@@ -158,6 +164,8 @@ class EntityReponder (blip.web.RecordLocator, blip.web.PageResponder):
 ## Tabs
 
 class OverviewTab (blip.html.TabProvider):
+    web_paths = ('person', 'team')
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) != 2 or request.path[0] not in ('person', 'team'):
@@ -234,15 +242,9 @@ class OverviewTab (blip.html.TabProvider):
             facts.start_fact_group ()
             span = blip.html.Span (divider=blip.html.SPACE)
             span.add_content (str(request.record.score))
-            lt = blip.db.Entity.select (blip.db.Entity.type == u'Person',
-                                        blip.db.Entity.score != 0,
-                                        blip.db.Entity.score <= request.record.score)
-            lt = lt.count()
-            gt = blip.db.Entity.select (blip.db.Entity.type == u'Person',
-                                        blip.db.Entity.score > request.record.score)
-            gt = gt.count()
-            if (lt + gt) > 0:
-                span.add_content ('(%.2f%%)' % ((100.0 * lt) / (lt + gt)))
+            rank = blip.db.ScoreRank.get_rank (request.record.ident)
+            if rank is not None and rank[1] is not None:
+                span.add_content ('(%.2f%%)' % rank[1])
             facts.add_fact (blip.utils.gettext ('Score'), span)
 
         return tab
@@ -260,11 +262,14 @@ class OverviewTab (blip.html.TabProvider):
         return response
 
 class TeamsTab (blip.html.TabProvider):
+    web_paths = ('person',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) != 2 or request.path[0] != 'person':
             return None
-        cnt = blip.db.TeamMember.select_related (pred=request.record).count ()
+        cnt = cls.get_count (request, 'teams',
+                             lambda: blip.db.TeamMember.count_related (pred=request.record))
         if cnt > 0:
             page.add_tab ('teams',
                           blip.utils.gettext ('Teams (%i)') % cnt,
@@ -293,11 +298,14 @@ class TeamsTab (blip.html.TabProvider):
 
 
 class MembersTab (blip.html.TabProvider):
+    web_paths = ('team',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) != 2 or request.path[0] != 'team':
             return None
-        cnt = blip.db.TeamMember.select_related (subj=request.record).count ()
+        cnt = cls.get_count (request, 'members',
+                             lambda: blip.db.TeamMember.count_related (subj=request.record))
         if cnt > 0:
             page.add_tab ('members',
                           blip.utils.gettext ('Members (%i)') % cnt,
@@ -325,13 +333,15 @@ class MembersTab (blip.html.TabProvider):
         return response
 
 class SubteamsTab (blip.html.TabProvider):
+    web_paths = ('team',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) != 2 or request.path[0] != 'team':
             return None
-        cnt = blip.db.Entity.select (blip.db.Entity.type == u'Team',
-                                     blip.db.Entity.parent_ident == request.record.ident)
-        cnt = cnt.count()
+        cnt = cls.get_count (request, 'subteams',
+                             lambda: blip.db.Entity.select (blip.db.Entity.type == u'Team',
+                                                            blip.db.Entity.parent_ident == request.record.ident).count ())
         if cnt > 0:
             page.add_tab ('subteams',
                           blip.utils.gettext ('Subteams (%i)') % cnt,
@@ -356,11 +366,14 @@ class SubteamsTab (blip.html.TabProvider):
         return response
 
 class ModulesTab (blip.html.TabProvider):
+    web_paths = ('person', 'team')
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) != 2 or request.path[0] not in ('person', 'team'):
             return None
-        cnt = blip.db.ModuleEntity.select_related (pred=request.record).count ()
+        cnt = cls.get_count (request, 'modules',
+                             lambda: blip.db.ModuleEntity.count_related (pred=request.record))
         if cnt > 0:
             page.add_tab ('modules',
                           blip.utils.gettext ('Modules (%i)') % cnt,
@@ -387,12 +400,15 @@ class ModulesTab (blip.html.TabProvider):
         return response
 
 class DocumentsTab (blip.html.TabProvider):
+    web_paths = ('person', 'team')
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) != 2 or request.path[0] not in ('person', 'team'):
             return None
-        cnt = blip.db.DocumentEntity.count_related (pred=request.record,
-                                                    subj_type=u'Document')
+        cnt = cls.get_count (request, 'docs',
+                             lambda: blip.db.DocumentEntity.count_related (pred=request.record,
+                                                                           subj_type=u'Document'))
         if cnt > 0:
             page.add_tab ('docs',
                           blip.utils.gettext ('Documents (%i)') % cnt,
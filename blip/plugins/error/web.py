@@ -32,6 +32,8 @@ import blip.plugins.index.web
 ## Pages
 
 class ErrorResponder (blip.web.PageResponder):
+    web_paths = ('error',)
+
     @classmethod
     def respond (cls, request, **kw):
         if len(request.path) != 1 or request.path[0] != 'error':
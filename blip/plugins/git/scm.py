@@ -25,14 +25,11 @@ Read information from a Git repository.
 import codecs
 import datetime
 import os
+import subprocess
 import sys
 
 import blip.scm
-
-try:
-    from email.utils import parseaddr
-except:
-    from email.Utils import parseaddr
+import blip.utils
 
 
 class GitClone (blip.scm.Repository):
@@ -124,73 +121,86 @@ class GitClone (blip.scm.Repository):
         return (revid, revdate)
 
 
+    def get_changed_files (self, since):
+        """
+        Get the files that changed in a Git repository since a revision.
+        """
+        cmd = ['git', 'diff', '--name-only', '-z', since, 'HEAD']
+        proc = subprocess.Popen (cmd, cwd=self.directory, stdout=subprocess.PIPE)
+        output = proc.communicate ()[0]
+        if proc.returncode != 0:
+            raise blip.scm.RepositoryError ('Could not read changes since %s for %s'
+                                            % (since, self.scm_module))
+        return [blip.utils.utf8dec (filename)
+                for filename in output.split ('\x00') if filename != '']
+
+
     def read_history (self, since=None):
         """
         Read the history of a Git repository.
+
+        This runs a single git log command with NUL-separated fields and
+        parses its output as it streams in, yielding commits oldest first.
         """
-        owd = os.getcwd ()
+        cmd = ['git', 'log', '--reverse', '--name-status', '-z',
+               '--pretty=format:%x01%H%x00%P%x00%at%x00%an%x00%ae%x00%B%x00']
+        if since != None:
+            cmd.append ('%s..%s' % (since, self.scm_branch))
+        else:
+            cmd.append (self.scm_branch)
+        proc = subprocess.Popen (cmd, cwd=self.directory, stdout=subprocess.PIPE)
         try:
-            os.chdir (self.directory)
-            cmd = 'git log --pretty="format:%H %P" '
-            if since != None:
-                cmd += '"%s..%s"' % (since, self.scm_branch)
-            else:
-                cmd += '"%s"' % self.scm_branch
-            allrevs = []
-            fd = codecs.getreader('utf-8')(os.popen (cmd), errors='replace')
-            for line in fd:
-                hashes = line.split()
-                revid = hashes[0]
-                parid = len(hashes) > 1 and hashes[1] or None
-                allrevs.insert (0, (revid, parid))
-            for revid, parid in allrevs:
-                cmd = 'git show --name-only ' + revid
-                author_email = None
-                author_name = None
-                revdate = None
-                comment = ''
-                revfiles = []
-                fd = codecs.getreader('utf-8')(os.popen (cmd), errors='replace')
-                line = fd.readline()
-                while line:
-                    if line.startswith ('Author: '):
-                        author_name, author_email = parseaddr (line[8:].strip())
-                    elif line.startswith ('Date: '):
-                        revdate = line[8:].strip()
-                        revdate = GitClone.parse_date (revdate)
-                    elif line.strip() == '':
-                        line = fd.readline()
-                        blank = False
-                        while line:
-                            if blank:
-                                if line.strip() != '' and line[0] != ' ':
-                                    break
-                                else:
-                                    comment += '\n'
-                            if line.strip() == '':
-                                blank = True
-                            else:
-                                blank = False
-                                if line.startswith ('    '):
-                                    comment += line[4:]
-                                else:
-                                    comment += line
-                            line = fd.readline()
-                        while line:
-                            revfiles.append ((line.strip(), revid, parid))
-                            line = fd.readline()
-                    if line:
-                        line = fd.readline()
-
-                yield blip.scm.Commit (self, id=revid, datetime=revdate,
-                                       author_email=author_email,
-                                       author_name=author_name,
-                                       comment=comment,
-                                       files=revfiles)
-        except:
-            os.chdir (owd)
-            raise
-        os.chdir (owd)
+            commit = None
+            tokens = GitClone._read_tokens (proc.stdout)
+            for token in tokens:
+                if token.startswith ('\x01'):
+                    if commit is not None:
+                        yield blip.scm.Commit (self, **commit)
+                    revid = token[1:]
+                    parid = tokens.next().split()
+                    parid = len(parid) > 0 and parid[0] or None
+                    revdate = datetime.datetime.utcfromtimestamp (int(tokens.next()))
+                    author_name = tokens.next()
+                    author_email = tokens.next()
+                    comment = tokens.next()
+                    commit = {'id': revid, 'datetime': revdate,
+                              'author_name': author_name,
+                              'author_email': author_email,
+                              'comment': comment,
+                              'files': []}
+                    continue
+                status = token.strip()
+                if status == '' or commit is None:
+                    continue
+                filename = tokens.next()
+                # Renames and copies list both the old and the new path.
+                if status[0] in ('R', 'C'):
+                    filename = tokens.next()
+                commit['files'].append ((blip.utils.utf8dec (filename),
+                                         revid, parid))
+            if commit is not None:
+                yield blip.scm.Commit (self, **commit)
+        finally:
+            proc.stdout.close ()
+            proc.wait ()
+
+
+    @staticmethod
+    def _read_tokens (fd, bufsize=65536):
+        """
+        Read NUL-separated tokens from a file object.
+        """
+        rest = ''
+        while True:
+            buf = fd.read (bufsize)
+            if not buf:
+                break
+            tokens = (rest + buf).split ('\x00')
+            rest = tokens.pop ()
+            for token in tokens:
+                yield token
+        if rest != '':
+            yield rest
 
 
     @staticmethod
@@ -45,6 +45,8 @@ class HomeHeaderLinks (blip.html.HeaderLinksProvider):
                                   blip.utils.gettext ('Home'))
 
 class HomePageResponder (blip.web.RecordLocator, blip.web.PageResponder):
+    web_paths = ('home',)
+
     @classmethod
     def locate_record (cls, request):
         if (len(request.path) == 1 and request.path[0] == 'home' and
@@ -65,6 +67,8 @@ class HomePageResponder (blip.web.RecordLocator, blip.web.PageResponder):
         return response
 
 class HomeTab (blip.html.TabProvider):
+    web_paths = ('home',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) != 1 or request.path[0] != 'home':
@@ -104,6 +108,8 @@ class HomeTab (blip.html.TabProvider):
         return response
 
 class WatchesTab (blip.html.TabProvider):
+    web_paths = ('home',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) != 1 or request.path[0] != 'home':
@@ -29,6 +29,8 @@ import blip.html
 import blip.utils
 
 class TranslationResponder (blip.web.RecordLocator, blip.web.PageResponder):
+    web_paths = ('l10n',)
+
     @classmethod
     def locate_record (cls, request):
         if not (len(request.path) in (6, 7) and request.path[0] == 'l10n'):
@@ -91,6 +93,8 @@ class TranslationResponder (blip.web.RecordLocator, blip.web.PageResponder):
         return response
 
 class OverviewTab (blip.html.TabProvider):
+    web_paths = ('l10n',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) < 1 or request.path[0] != 'l10n':
@@ -201,6 +205,8 @@ class OverviewTab (blip.html.TabProvider):
 
 
 class TranslationsTab (blip.html.TabProvider):
+    web_paths = ('mod', 'doc')
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) < 1 or request.path[0] not in ('mod', 'doc'):
@@ -212,15 +218,16 @@ class TranslationsTab (blip.html.TabProvider):
             domain = blip.db.ClassAlias (blip.db.Branch)
             using = store.using (blip.db.LeftJoin (blip.db.Branch, domain,
                                                    blip.db.Branch.parent_ident == domain.ident))
-            cnt = using.find (blip.db.Branch.scm_file,
+            sel = using.find (blip.db.Branch.scm_file,
                               blip.db.Branch.type == u'Translation',
                               domain.type == u'Domain',
                               domain.parent_ident == request.record.ident
-                              ).config(distinct=True).count()
+                              ).config(distinct=True)
         elif request.record.type == u'Document':
-            cnt = blip.db.Branch.select (parent=request.record, type=u'Translation').count ()
+            sel = blip.db.Branch.select (parent=request.record, type=u'Translation')
         else:
             return None
+        cnt = cls.get_count (request, 'translations', sel.count)
         if cnt > 0:
             page.add_tab ('i18n',
                           blip.utils.gettext ('Translations (%i)') % cnt,
@@ -367,6 +374,8 @@ class TranslationsTab (blip.html.TabProvider):
         return response
 
 class DomainsTab (blip.html.TabProvider):
+    web_paths = ('set',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) < 1:
@@ -375,7 +384,7 @@ class DomainsTab (blip.html.TabProvider):
             return None
         cnt = blip.db.Branch.select (type=u'Domain',
                                       parent_in_set=request.record)
-        cnt = cnt.count ()
+        cnt = cls.get_count (request, 'domains', cnt.count)
         if cnt > 0:
             page.add_tab ('domains',
                           blip.utils.gettext ('Domains (%i)') % cnt,
@@ -25,6 +25,8 @@ import blip.web
 import blip.utils
 
 class IndexResponder (blip.web.PageResponder):
+    web_paths = ('',)
+
     @classmethod
     def respond (cls, request, **kw):
         if len(request.path) != 0:
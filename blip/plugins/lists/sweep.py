@@ -185,41 +185,40 @@ class ListsResponder (blip.sweep.SweepResponder,
         cls.update_score (ml)
 
         ml.updated = datetime.datetime.utcnow ()
+        blip.db.CacheVersion.bump (ml.ident)
+        blip.db.RecordSummary.touch (ml)
         blip.db.Queue.pop (ml.ident)
 
     @classmethod
     def update_score (cls, ml):
-        store = blip.db.get_store (blip.db.ForumPost)
         thisweek = blip.utils.weeknum()
-        sel = store.find ((blip.db.ForumPost.weeknum, blip.db.Count('*')),
-                          blip.db.And (blip.db.ForumPost.forum == ml,
-                                       blip.db.ForumPost.weeknum > thisweek - 26,
-                                       blip.db.ForumPost.weeknum <= thisweek))
-        sel = sel.group_by (blip.db.ForumPost.weeknum)
-        sel = sel.order_by (blip.db.Desc (blip.db.ForumPost.weeknum))
+        blip.db.ActivityWeek.flush_counts ()
+        sel = blip.db.ActivityWeek.get_counts (ml.ident, u'forum',
+                                               blip.db.ActivityWeek.weeknum > thisweek - 26,
+                                               blip.db.ActivityWeek.weeknum <= thisweek)
         stats = [0 for i in range(26)]
         for week, cnt in list(sel):
             stats[week - (thisweek - 25)] = cnt
-        ml.score = blip.utils.score (stats)
-
-        stats = stats[:-3]
-        avg = int(round(sum(stats) / (len(stats) * 1.0)))
-        stats = stats + [avg, avg, avg]
-        old = blip.utils.score (stats)
-        ml.score_diff = ml.score - old
+        (ml.score, ml.score_diff) = blip.utils.score_with_diff (stats)
 
     @classmethod
     def update_scores (cls, request, ident):
+        store = blip.db.get_store (blip.db.ForumPost)
+        thisweek = blip.utils.weeknum()
+        args = [blip.db.Forum.type == u'List']
+        weekargs = [blip.db.ActivityWeek.weeknum > thisweek - 26,
+                    blip.db.ActivityWeek.weeknum <= thisweek]
         if ident is not None:
-            mls = list(blip.db.Forum.select (blip.db.Forum.type == u'List',
-                                             blip.db.Forum.ident.like (ident),
-                                             blip.db.Forum.score > 0))
-        else:
-            mls = list(blip.db.Forum.select (blip.db.Forum.type == u'List',
-                                             blip.db.Forum.score > 0))
-        for ml in mls:
-            blip.utils.log ('Updating score for ' + ml.ident)
-            cls.update_score (ml)
+            args.append (blip.db.Forum.ident.like (ident))
+            weekargs.append (blip.db.ActivityWeek.owner_ident.like (ident))
+        blip.utils.log ('Updating scores for mailing lists')
+        blip.db.ActivityWeek.flush_counts ()
+        counts = blip.db.ActivityWeek.select_counts (u'forum', *weekargs)
+        current = store.find ((blip.db.Forum.ident,
+                               blip.db.Forum.score,
+                               blip.db.Forum.score_diff),
+                              *args)
+        cls.set_scores (blip.db.Forum, list(counts), list(current))
 
     @classmethod
     def update_archive (cls, ml, request, cache, archive):
@@ -243,6 +242,7 @@ class ListsResponder (blip.sweep.SweepResponder,
             msgid = blip.utils.utf8dec (email.utils.parseaddr (msgid)[1])
             ident = ml.ident + u'/' + msgid
             post = blip.db.ForumPost.get_or_create (ident, u'ListPost')
+            oldweek = (post.forum_ident, post.weeknum)
             post.forum_ident = ml.ident
             post.name = decode_header (msgsubject)
 
@@ -261,6 +261,7 @@ class ListsResponder (blip.sweep.SweepResponder,
             if person.ident != personident:
                 post.person_alias_ident = personident
             blip.db.Queue.push (person.ident)
+            blip.db.CacheVersion.bump (person.ident)
 
             # The Date header is screwed up way too often. We'll get the
             # date from the Received header, if at all possible.
@@ -296,6 +297,9 @@ class ListsResponder (blip.sweep.SweepResponder,
                     dt = None
             post.datetime = dt
             post.weeknum = blip.utils.weeknum (dt)
+            if oldweek != (post.forum_ident, post.weeknum):
+                blip.db.ActivityWeek.add (oldweek[0], u'forum', oldweek[1], -1)
+                blip.db.ActivityWeek.add (post.forum_ident, u'forum', post.weeknum)
             post.make_messages ()
 
             msgdesc = ''
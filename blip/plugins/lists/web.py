@@ -53,6 +53,8 @@ class ListPostMessageFormatter (blip.plugins.home.web.MessageFormatter):
         return None
 
 class AllListsResponder (blip.web.PageResponder):
+    web_paths = ('list',)
+
     @classmethod
     def respond (cls, request, **kw):
         if len(request.path) != 1 or request.path[0] != 'list':
@@ -109,6 +111,9 @@ class ListsIndexContentProvider (blip.plugins.index.web.IndexContentProvider):
 
 
 class ListSparkResponder (blip.web.DataResponder):
+    web_paths = ('list',)
+    web_queries = ('spark',)
+
     @classmethod
     def respond (cls, request):
         if request.query.get ('d', None) != 'spark':
@@ -123,11 +128,8 @@ class ListSparkResponder (blip.web.DataResponder):
         response.payload = json
 
         thisweek = blip.utils.weeknum()
-        store = blip.db.get_store (blip.db.ForumPost)
-        sel = store.find ((blip.db.ForumPost.weeknum, blip.db.Count('*')),
-                          blip.db.ForumPost.forum == request.record,
-                          blip.db.ForumPost.weeknum > (thisweek - 208))
-        sel = sel.group_by (blip.db.ForumPost.weeknum)
+        sel = blip.db.ActivityWeek.get_counts (request.record.ident, u'forum',
+                                               blip.db.ActivityWeek.weeknum > (thisweek - 208))
         stats = [0 for i in range(208)]
         for week, cnt in list(sel):
             stats[week - (thisweek - 207)] = cnt
@@ -137,6 +139,8 @@ class ListSparkResponder (blip.web.DataResponder):
 
 
 class ListReponder (blip.web.RecordLocator, blip.web.PageResponder):
+    web_paths = ('list',)
+
     @classmethod
     def locate_record (cls, request):
         if len(request.path) != 3 or request.path[0] != 'list':
@@ -164,6 +168,8 @@ class ListReponder (blip.web.RecordLocator, blip.web.PageResponder):
         return response
 
 class OverviewTab (blip.html.TabProvider):
+    web_paths = ('list',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) != 3 or request.path[0] != 'list':
@@ -259,14 +265,18 @@ class OverviewTab (blip.html.TabProvider):
         return response
 
 class ListPostsTab (blip.html.TabProvider):
+    web_paths = ('list', 'person', 'team')
+
     @classmethod
     def add_tabs (cls, page, request):
         if request.record is None:
             return
         if isinstance (request.record, blip.db.Forum) and request.record.type == u'List':
-            cnt = blip.db.ForumPost.select (forum=request.record).count ()
+            cnt = cls.get_count (request, 'posts',
+                                 lambda: blip.db.ForumPost.select (forum=request.record).count ())
         elif isinstance (request.record, blip.db.Entity):
-            cnt = blip.db.ForumPost.select (author=request.record).count ()
+            cnt = cls.get_count (request, 'posts',
+                                 lambda: blip.db.ForumPost.select (author=request.record).count ())
         else:
             cnt = None
         if cnt is not None and cnt > 0:
@@ -293,10 +303,13 @@ class ListPostsTab (blip.html.TabProvider):
         graph = blip.html.BarGraph ()
         tab.add_content (graph)
 
-        store = blip.db.get_store (blip.db.ForumPost)
-        sel = store.find ((blip.db.ForumPost.weeknum, blip.db.Count('*')), sel)
-        sel = sel.group_by (blip.db.ForumPost.weeknum)
-        sel = sel.order_by (blip.db.ForumPost.weeknum)
+        if isinstance (request.record, blip.db.Forum):
+            sel = blip.db.ActivityWeek.get_counts (request.record.ident, u'forum')
+        else:
+            store = blip.db.get_store (blip.db.ForumPost)
+            sel = store.find ((blip.db.ForumPost.weeknum, blip.db.Count('*')), sel)
+            sel = sel.group_by (blip.db.ForumPost.weeknum)
+            sel = sel.order_by (blip.db.ForumPost.weeknum)
 
         curweek = blip.utils.weeknum()
         lastweek = None
@@ -426,6 +439,9 @@ class ListPostsTab (blip.html.TabProvider):
         return response
 
 class ListPostsDiv (blip.web.ContentResponder):
+    web_paths = ('list', 'person', 'team')
+    web_queries = ('posts',)
+
     @classmethod
     def respond (cls, request):
         if request.query.get ('q', None) != 'posts':
@@ -504,13 +520,16 @@ class ListPostsDiv (blip.web.ContentResponder):
 
 
 class ListThreadsTab (blip.html.TabProvider):
+    web_paths = ('list',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if request.record is None:
             return
         if not (isinstance (request.record, blip.db.Forum) and request.record.type == u'List'):
             return
-        cnt = blip.db.ForumPost.select (forum=request.record).count ()
+        cnt = cls.get_count (request, 'posts',
+                             lambda: blip.db.ForumPost.select (forum=request.record).count ())
         if cnt > 0:
             page.add_tab ('threads',
                           blip.utils.gettext ('Threads'),
@@ -576,6 +595,9 @@ class ListThreadsTab (blip.html.TabProvider):
 
 
 class ListThreadsDiv (blip.web.ContentResponder):
+    web_paths = ('list',)
+    web_queries = ('threads',)
+
     @classmethod
     def respond (cls, request):
         if request.query.get ('q', None) != 'threads':
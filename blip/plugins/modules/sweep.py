@@ -23,8 +23,18 @@ Update information from projects and branches
 """
 
 import datetime
+import fnmatch
+import multiprocessing
 import os
+import Queue
 
+try:
+    import scandir
+    _walk = scandir.walk
+except ImportError:
+    _walk = os.walk
+
+import blinq.config
 import blinq.ext
 
 import blip.db
@@ -70,6 +80,15 @@ class ModulesResponder (blip.sweep.SweepResponder,
                                  dest='until',
                                  metavar='SECONDS',
                                  help='only process modules older than SECONDS seconds')
+        request.add_tool_option ('--jobs',
+                                 dest='jobs',
+                                 metavar='NUM',
+                                 help='update up to NUM SCM repositories at once')
+        request.add_tool_option ('--scheduled',
+                                 dest='scheduled',
+                                 action='store_true',
+                                 default=False,
+                                 help='only process modules that are due, most important first')
 
     @classmethod
     def respond (cls, request):
@@ -130,23 +149,88 @@ class ModulesResponder (blip.sweep.SweepResponder,
                                                             blip.db.Branch.ident.like (ident),
                                                             *dbargs))
         branches = blinq.utils.attrsorted (branches, 'updated')
+        if request.get_tool_option ('scheduled'):
+            branches = cls.get_scheduled (branches)
+
+        jobs = request.get_tool_option ('jobs')
+        if jobs is not None:
+            try:
+                jobs = int(jobs)
+            except ValueError:
+                jobs = 0
+            if jobs < 1:
+                response.set_error (1, 'The --jobs option must be a number of at least 1')
+                return response
+
+        def out_of_time ():
+            return (timelimit is not None and
+                    (datetime.datetime.now() - timestart).seconds > timelimit)
+
+        pool = None
+        if jobs is not None and jobs > 1 and request.get_tool_option ('update_scm'):
+            # Updating repositories is mostly waiting on the network, so we
+            # hand it off to a pool of worker processes. The workers never
+            # touch the database. We scan each branch in this process as
+            # soon as its repository is ready.  Only jobs updates are given
+            # to the pool at a time, so we can stop handing out more when
+            # we run out of time.
+            pool = multiprocessing.Pool (jobs)
+            results = Queue.Queue ()
+            waiting = list(branches)
+            byident = {}
+            for branch in branches:
+                byident[branch.ident] = branch
+            def submit ():
+                branch = waiting.pop (0)
+                pool.apply_async (_update_repository,
+                                  [(branch.ident, cls.get_scm_args (branch))],
+                                  callback=results.put)
+            def ready_branches ():
+                running = 0
+                while running < jobs and len(waiting) > 0:
+                    submit ()
+                    running += 1
+                while running > 0:
+                    (ident, error) = results.get ()
+                    running -= 1
+                    if len(waiting) > 0 and not out_of_time ():
+                        submit ()
+                        running += 1
+                    yield (byident[ident], error)
+            branches = ready_branches ()
+        else:
+            branches = [(branch, None) for branch in branches]
+
         ident_i = 0
-        for branch in branches:
+        for branch, error in branches:
             try:
-                scanner = ModuleScanner (request, branch)
+                if pool is not None:
+                    scanner = ModuleScanner (request, branch, update=False, checkout=False)
+                    if error is not None:
+                        scanner.repository.error = error
+                else:
+                    scanner = ModuleScanner (request, branch)
                 scanner.update ()
+                cls.schedule_branch (branch, scanner.repository.error is not None)
                 blip.db.flush ()
                 ident_i += 1
             except Exception, err:
                 blip.db.rollback ()
                 blip.utils.warn (str(err))
+                cls.schedule_branch (branch, True)
+                blip.db.commit ()
             else:
                 blip.db.commit ()
 
-            if (timelimit is not None and
-                (datetime.datetime.now() - timestart).seconds > timelimit):
+            if out_of_time ():
                 break;
 
+        if pool is not None:
+            # Let updates that already started finish, so we don't leave
+            # lock files and half-updated checkouts behind.
+            pool.close ()
+            pool.join ()
+
         if timelimit is not None:
             diff = datetime.datetime.now () - timestart
             diff = datetime.timedelta (days=diff.days, seconds=diff.seconds)
@@ -154,18 +238,87 @@ class ModulesResponder (blip.sweep.SweepResponder,
 
         return response
 
+    @staticmethod
+    def get_scheduled (branches):
+        """
+        Get the branches that are due for an update, by descending priority.
+
+        Branches that have never been scheduled come first.
+        """
+        now = datetime.datetime.utcnow ()
+        schedules = blip.db.Schedule.get_schedules ([branch.ident for branch in branches])
+        new = []
+        due = []
+        for branch in branches:
+            sched = schedules.get (branch.ident)
+            if sched is None:
+                new.append (branch)
+            elif sched.due is None or sched.due <= now:
+                due.append ((sched.priority or 0, branch))
+        due.sort (key=lambda pair: pair[0], reverse=True)
+        return new + [branch for priority, branch in due]
+
+    @staticmethod
+    def schedule_branch (branch, failed):
+        """
+        Schedule the next update of a branch after updating it.
+        """
+        blip.db.Schedule.set_result (branch.ident, score=branch.score,
+                                     activity=branch.mod_datetime, failed=failed)
+
+    @staticmethod
+    def get_scm_args (branch):
+        """
+        Get the keyword arguments to create a Repository for a branch.
+        """
+        return {'scm_type': branch.scm_type,
+                'scm_server': branch.scm_server,
+                'scm_module': branch.scm_module,
+                'scm_branch': branch.scm_branch,
+                'scm_path': branch.scm_path}
+
     @classmethod
     def update_scores (cls, request, ident):
+        store = blip.db.get_store (blip.db.Revision)
+        thisweek = blip.utils.weeknum()
+        args = [blip.db.Branch.type == u'Module']
+        weekargs = [blip.db.ActivityWeek.weeknum > thisweek - 26,
+                    blip.db.ActivityWeek.weeknum <= thisweek]
         if ident is not None:
-            mods = list(blip.db.Branch.select (blip.db.Branch.type == u'Module',
-                                               blip.db.Branch.ident.like (ident),
-                                               blip.db.Branch.score > 0))
-        else:
-            mods = list(blip.db.Branch.select (blip.db.Branch.type == u'Module',
-                                               blip.db.Branch.score > 0))
-        for mod in mods:
-            blip.utils.log ('Updating score for ' + mod.ident)
-            ModuleScanner.update_score (mod)
+            args.append (blip.db.Branch.ident.like (ident))
+            weekargs.append (blip.db.ActivityWeek.owner_ident.like (ident))
+        blip.utils.log ('Updating scores for modules')
+        blip.db.ActivityWeek.flush_counts ()
+        counts = blip.db.ActivityWeek.select_counts (u'branch', *weekargs)
+        current = store.find ((blip.db.Branch.ident,
+                               blip.db.Branch.score,
+                               blip.db.Branch.score_diff),
+                              *args)
+        cls.set_scores (blip.db.Branch, list(counts), list(current))
+
+        # A project gets the score of its highest-scoring branch.
+        projects = store.find (blip.db.Branch.project_ident, *args)
+        projects.config (distinct=True)
+        projects = list(projects)
+        projscores = {}
+        current = []
+        for start in range (0, len(projects), 500):
+            sub = projects[start:start + 500]
+            for proj, score, score_diff in store.find ((blip.db.Branch.project_ident,
+                                                        blip.db.Branch.score,
+                                                        blip.db.Branch.score_diff),
+                                                       blip.db.Branch.project_ident.is_in (sub)):
+                if not projscores.has_key (proj) or score > projscores[proj][0]:
+                    projscores[proj] = (score, score_diff)
+            current += list(store.find ((blip.db.Project.ident,
+                                         blip.db.Project.score,
+                                         blip.db.Project.score_diff),
+                                        blip.db.Project.ident.is_in (sub)))
+        cls.write_scores (blip.db.Project, projscores, current)
+
+        ranks = store.find ((blip.db.Project.ident, blip.db.Project.score),
+                            blip.db.Project.type == u'Module')
+        blip.db.ScoreRank.set_ranks (u'project', list(ranks))
 
     @classmethod
     def process_queued (cls, ident, request):
@@ -178,15 +331,43 @@ class ModulesResponder (blip.sweep.SweepResponder,
                 try:
                     scanner = ModuleScanner (request, mod)
                     scanner.update ()
+                    cls.schedule_branch (mod, scanner.repository.error is not None)
                     blip.db.flush ()
                 except:
                     blip.db.rollback ()
+                    cls.schedule_branch (mod, True)
+                    blip.db.commit ()
                     raise
                 else:
                     blip.db.commit ()
 
 
+def _update_repository (args):
+    """
+    Check out or update a repository in a worker process.
+
+    This takes a tuple of a branch ident and the keyword arguments for
+    the Repository, and returns a tuple of the ident and any error.
+    """
+    ident, scm_args = args
+    try:
+        repository = blip.scm.Repository (update=True, **scm_args)
+        return (ident, repository.error)
+    except Exception, err:
+        return (ident, str(err))
+
+
 class ModuleFileScanner (blinq.ext.ExtensionPoint):
+    # Plugins can declare which files they care about, so ModuleScanner
+    # only calls process_file for matching files. file_basenames is a list
+    # of exact basenames, file_globs is a list of fnmatch patterns, and
+    # file_depth is the deepest directory to look in, where 0 is the top
+    # of the checkout. If neither file_basenames nor file_globs is set,
+    # process_file is called for every file.
+    file_basenames = None
+    file_globs = None
+    file_depth = None
+
     def __init__ (self, scanner):
         self.scanner = scanner
 
@@ -198,12 +379,15 @@ class ModuleFileScanner (blinq.ext.ExtensionPoint):
 
 
 class ModuleScanner (object):
-    def __init__ (self, request, branch):
+    # How many commits to read before writing them to the database
+    history_batch = 500
+
+    def __init__ (self, request, branch, **kw):
         self.request = request
         self.branch = branch
         self._file_scanners = []
-        self.repository = blip.scm.Repository.from_record (branch,
-                                                           update=request.get_tool_option ('update_scm'))
+        kw.setdefault ('update', request.get_tool_option ('update_scm'))
+        self.repository = blip.scm.Repository.from_record (branch, **kw)
         for cls in ModuleFileScanner.get_extensions ():
             try:
                 scanner = cls (self)
@@ -212,22 +396,78 @@ class ModuleScanner (object):
                 blip.utils.warn ('Could not create instance of ' + cls.__name__)
         self._parsed_files = {}
         self._children = {}
+        self.changed_files = None
+
+        self._scanners_by_basename = {}
+        self._scanners_by_glob = []
+        self._scanners_for_all = []
+        self._scanners_cache = {}
+        # The deepest directory any scanner looks in, or None if some
+        # scanner wants files at any depth.
+        depths = [scanner.file_depth for scanner in self._file_scanners]
+        if len(depths) > 0 and None not in depths:
+            self._max_depth = max (depths)
+        else:
+            self._max_depth = None
+        for scanner in self._file_scanners:
+            if scanner.file_basenames is None and scanner.file_globs is None:
+                self._scanners_for_all.append (scanner)
+                continue
+            for basename in (scanner.file_basenames or []):
+                self._scanners_by_basename.setdefault (basename, []).append (scanner)
+            for glob in (scanner.file_globs or []):
+                self._scanners_by_glob.append ((glob, scanner))
 
     def add_child (self, child):
         self._children.setdefault (child.type, [])
         if child not in self._children[child.type]:
             self._children[child.type].append (child)
 
+    def get_file_scanners (self, basename):
+        """
+        Get the file scanners interested in files named basename.
+        """
+        scanners = self._scanners_cache.get (basename)
+        if scanners is None:
+            scanners = list (self._scanners_by_basename.get (basename, []))
+            for glob, scanner in self._scanners_by_glob:
+                if scanner not in scanners and fnmatch.fnmatch (basename, glob):
+                    scanners.append (scanner)
+            scanners += self._scanners_for_all
+            self._scanners_cache[basename] = scanners
+        return scanners
+
+    def process_files (self, dirname, basenames):
+        """
+        Give the files basenames in the directory dirname to the file scanners.
+        """
+        depth = None
+        for basename in basenames:
+            scanners = self.get_file_scanners (basename)
+            if len(scanners) == 0:
+                continue
+            if depth is None:
+                reldir = os.path.relpath (dirname, self.repository.directory)
+                if reldir == os.curdir:
+                    depth = 0
+                else:
+                    depth = len (reldir.split (os.sep))
+            for scanner in scanners:
+                if scanner.file_depth is None or depth <= scanner.file_depth:
+                    scanner.process_file (dirname, basename)
+
     def get_parsed_file (self, parser, filename):
         if not self._parsed_files.has_key ((parser, filename)):
             self._parsed_files[(parser, filename)] = parser (filename)
         return self._parsed_files[(parser, filename)]
 
     def update (self):
+        sourcefunc = blip.db.get_sourcefunc (ModuleScanner.update)
         if self.repository.error is None:
-            blip.db.Error.clear_error (self.branch)
+            blip.db.Error.clear_error (self.branch, sourcefunc=sourcefunc)
         else:
-            blip.db.Error.set_error (self.branch, self.repository.error)
+            blip.db.Error.set_error (self.branch, self.repository.error,
+                                     sourcefunc=sourcefunc)
 
         if self.request.get_tool_option ('read_history', True):
             self.check_history ()
@@ -243,59 +483,129 @@ class ModuleScanner (object):
             reprev = self.repository.get_revision()[0]
         except:
             reprev = None
+        currev = None
         if reprev is not None and self.request.get_tool_option ('timestamps'):
             currev = self.branch.data.get ('current_revision')
             if currev == reprev:
                 dovisit = False
 
         if dovisit:
-            def visit (arg, dirname, names):
-                ignore = self.repository.ignoredir
-                if ignore in names:
-                    names.remove (ignore)
-                for basename in names:
-                    filename = os.path.join (dirname, basename)
-                    if not os.path.isfile (filename):
-                        continue
-                    for scanner in self._file_scanners:
-                        scanner.process_file (dirname, basename)
-            os.path.walk (self.repository.directory, visit, None)
-
-            for scanner in self._file_scanners:
-                scanner.post_process ()
-
-            for objtype in self._children.keys ():
-                self.branch.set_children (objtype, self._children[objtype])
-
+            # Timestamps for every file in the checkout are loaded at once,
+            # and changed timestamps are written back when we're done.
+            prefix = blip.utils.relative_path (self.repository.directory,
+                                               blinq.config.scm_dir)
+            blip.db.Timestamp.start_preload (blip.utils.utf8dec (prefix) + u'/')
+            try:
+                self.scan_files (currev)
+            except:
+                blip.db.Timestamp.end_preload (write=False)
+                raise
+            blip.db.Timestamp.end_preload ()
             self.branch.data['current_revision'] = reprev
         else:
             blip.utils.log ('Skipping file scanning for %s' % self.branch.ident)
 
         self.branch.updated = datetime.datetime.utcnow ()
+        blip.db.CacheVersion.bump (self.branch.ident, self.branch.project_ident)
         blip.db.Queue.pop (self.branch.ident)
 
+    def scan_files (self, currev):
+        """
+        Give files in the checkout to the file scanners.
+
+        If currev is the last revision we scanned, and the repository can
+        tell us what changed since then, only changed files are scanned.
+        """
+        self.changed_files = None
+        if currev is not None:
+            self.changed_files = self.get_changed_files (currev)
+        if self.changed_files is None:
+            ignore = self.repository.ignoredir
+            top = os.path.normpath (self.repository.directory)
+            for dirname, dirnames, basenames in _walk (top):
+                if ignore in dirnames:
+                    dirnames.remove (ignore)
+                if self._max_depth is not None:
+                    # Don't descend into directories no scanner looks in.
+                    if dirname == top:
+                        depth = 0
+                    else:
+                        depth = dirname[len(top):].count (os.sep)
+                    if depth >= self._max_depth:
+                        del dirnames[:]
+                self.process_files (dirname, basenames)
+        else:
+            blip.utils.log ('Scanning %i changed files for %s'
+                            % (len(self.changed_files), self.branch.ident))
+            # Children found in unchanged files won't be found again,
+            # so start from what we already know about.
+            for child in blip.db.Branch.select (parent=self.branch):
+                self.add_child (child)
+            # Files in a directory above a changed file, like a Makefile.am
+            # or configure.ac, can depend on the changed file, so visit every
+            # directory from each changed file up to the top of the checkout.
+            top = os.path.normpath (self.repository.directory)
+            changed_dirs = set()
+            for filename in self.changed_files:
+                if not os.path.isfile (filename):
+                    continue
+                dirname = os.path.normpath (os.path.dirname (filename))
+                while dirname not in changed_dirs:
+                    changed_dirs.add (dirname)
+                    if dirname == top or not dirname.startswith (top + os.sep):
+                        break
+                    dirname = os.path.dirname (dirname)
+            for dirname in sorted (changed_dirs):
+                basenames = [basename for basename in os.listdir (dirname)
+                             if os.path.isfile (os.path.join (dirname, basename))]
+                self.process_files (dirname, basenames)
+
+        for scanner in self._file_scanners:
+            scanner.post_process ()
+
+        for objtype in self._children.keys ():
+            self.branch.set_children (objtype, self._children[objtype])
+
+    def get_changed_files (self, since):
+        """
+        Get the absolute paths of the files changed since a revision.
+
+        This returns None if the repository can't tell us what changed,
+        or if any files were removed, since removed files might have
+        provided children that we need to forget about. In those cases,
+        the caller should walk the whole checkout.
+        """
+        try:
+            changed = self.repository.get_changed_files (since)
+        except NotImplementedError:
+            return None
+        except Exception, err:
+            blip.utils.warn ('Could not get changed files for %s: %s'
+                             % (self.branch.ident, str(err)))
+            return None
+        ignore = self.repository.ignoredir
+        files = []
+        for filename in changed:
+            if ignore is not None and ignore in filename.split ('/'):
+                continue
+            filename = os.path.join (self.repository.directory, filename)
+            if not os.path.exists (filename):
+                return None
+            files.append (filename)
+        return files
+
     @classmethod
     def update_score (cls, branch):
         store = blip.db.get_store (blip.db.Revision)
         thisweek = blip.utils.weeknum()
-        sel = store.using (blip.db.Revision,
-                           blip.db.Join (blip.db.RevisionBranch,
-                                         blip.db.RevisionBranch.revision_ident == blip.db.Revision.ident))
-        sel = sel.find ((blip.db.Revision.weeknum, blip.db.Count('*')),
-                        blip.db.And (blip.db.RevisionBranch.branch_ident == branch.ident,
-                                     blip.db.Revision.weeknum > thisweek - 26,
-                                     blip.db.Revision.weeknum <= thisweek))
-        sel = sel.group_by (blip.db.Revision.weeknum)
+        blip.db.ActivityWeek.flush_counts ()
+        sel = blip.db.ActivityWeek.get_counts (branch.ident, u'branch',
+                                               blip.db.ActivityWeek.weeknum > thisweek - 26,
+                                               blip.db.ActivityWeek.weeknum <= thisweek)
         stats = [0 for i in range(26)]
         for week, cnt in list(sel):
             stats[week - (thisweek - 25)] = cnt
-        branch.score = blip.utils.score (stats)
-
-        stats = stats[:-3]
-        avg = int(round(sum(stats) / (len(stats) * 1.0)))
-        stats = stats + [avg, avg, avg]
-        old = blip.utils.score (stats)
-        branch.score_diff = branch.score - old
+        (branch.score, branch.score_diff) = blip.utils.score_with_diff (stats)
 
         scores = store.find ((blip.db.Branch.score, blip.db.Branch.score_diff),
                              blip.db.Branch.project_ident == branch.project_ident)
@@ -303,6 +613,145 @@ class ModuleScanner (object):
         branch.project.score = scores[0]
         branch.project.score_diff = scores[1]
 
+    def get_commit_people (self, commits):
+        """
+        Get the people who authored a batch of commits.
+
+        This returns a dictionary mapping each commit's author_ident to
+        an Entity, creating entities only for people we don't know yet.
+        """
+        lookup = {}
+        for commit in commits:
+            if commit.author_id is None and commit.author_email is not None:
+                if commit.author_email.find ('@') < 0:
+                    lookup[commit.author_ident] = u'/person/' + commit.author_email + u'@'
+                else:
+                    lookup[commit.author_ident] = u'/person/' + commit.author_email
+            else:
+                lookup[commit.author_ident] = commit.author_ident
+
+        found = {}
+        idents = list (set (lookup.values ()))
+        for ent in blip.db.Entity.select (blip.db.Entity.ident.is_in (idents)):
+            found[ent.ident] = ent
+        missing = [ident for ident in idents if not found.has_key (ident)]
+        if len(missing) > 0:
+            for alias in blip.db.Alias.select (blip.db.Alias.ident.is_in (missing)):
+                found[alias.ident] = alias.entity
+
+        people = {}
+        for commit in commits:
+            if people.has_key (commit.author_ident):
+                continue
+            person = found.get (lookup[commit.author_ident])
+            if person is None:
+                if commit.author_id is not None:
+                    person = blip.db.Entity.get_or_create (commit.author_ident, u'Person')
+                elif commit.author_email is not None:
+                    person = blip.db.Entity.get_or_create_email (commit.author_email)
+                else:
+                    person = blip.db.Entity.get_or_create (commit.author_ident, u'Ghost')
+                found[lookup[commit.author_ident]] = person
+            people[commit.author_ident] = person
+        return people
+
+    def add_commits (self, commits):
+        """
+        Add a batch of commits to the database.
+
+        Existing revisions and authors are looked up with one query each
+        for the whole batch, and new Revision, RevisionFile, and
+        RevisionBranch records are written with multi-row INSERTs.
+        """
+        store = blip.db.get_store (blip.db.Revision)
+        project_ident = self.branch.project_ident
+        people = self.get_commit_people (commits)
+        for commit in commits:
+            person = people[commit.author_ident]
+            if person.type == u'Person':
+                blip.db.Queue.push (person.ident)
+            blip.db.CacheVersion.bump (person.ident)
+            if commit.author_name is not None:
+                person.extend (name=commit.author_name)
+            if commit.author_email is not None:
+                person.extend (email=commit.author_email)
+        blip.db.flush ()
+
+        revidents = [project_ident + u'/' + commit.id for commit in commits]
+        existing = dict (store.find ((blip.db.Revision.ident, blip.db.Revision.datetime),
+                                     blip.db.Revision.ident.is_in (revidents)))
+        onbranch = set ()
+        if len(existing) > 0:
+            onbranch = set (store.find (blip.db.RevisionBranch.revision_ident,
+                                        blip.db.RevisionBranch.branch_ident == self.branch.ident,
+                                        blip.db.RevisionBranch.revision_ident.is_in (existing.keys ())))
+
+        revrows = []
+        filerows = []
+        branchrows = []
+        head = None
+        for revident, commit in zip (revidents, commits):
+            if head is None or commit.datetime > head[1].datetime:
+                head = (revident, commit)
+            if revident in onbranch:
+                continue
+            weeknum = blip.utils.weeknum (commit.datetime)
+            branchrows.append ({'revision_ident': revident,
+                                'branch_ident': self.branch.ident})
+            blip.db.ActivityWeek.add (self.branch.ident, u'branch', weeknum)
+            onbranch.add (revident)
+            if existing.has_key (revident):
+                continue
+            person = people[commit.author_ident]
+            blip.db.ActivityWeek.add (person.ident, u'person', weeknum)
+            alias_ident = None
+            if person.ident != commit.author_ident:
+                alias_ident = commit.author_ident
+            revrows.append ({'ident': revident,
+                             'project_ident': project_ident,
+                             'person_ident': person.ident,
+                             'person_alias_ident': alias_ident,
+                             'revision': commit.id,
+                             'datetime': commit.datetime,
+                             'weeknum': weeknum,
+                             'comment': commit.comment})
+            filenames = []
+            for filename, filerev, prevrev in commit.files:
+                if filename in filenames:
+                    continue
+                filenames.append (filename)
+                filerows.append ({'revision_ident': revident,
+                                  'filename': filename,
+                                  'filerev': filerev,
+                                  'prevrev': prevrev})
+            blip.db.Revision.cache_files (self.branch.ident, revident,
+                                          commit.datetime, filenames)
+            blip.db.Message.make_message (u'commit', person.ident, project_ident, commit.datetime)
+            blip.db.Message.make_message (u'commit', project_ident, None, commit.datetime)
+
+        # Revisions we already had from another branch need their files
+        # noted for this branch too.
+        shared = [row['revision_ident'] for row in branchrows
+                  if existing.has_key (row['revision_ident'])]
+        if len(shared) > 0:
+            sharedfiles = {}
+            for revident, filename in store.find ((blip.db.RevisionFile.revision_ident,
+                                                   blip.db.RevisionFile.filename),
+                                                  blip.db.RevisionFile.revision_ident.is_in (shared)):
+                sharedfiles.setdefault (revident, []).append (filename)
+            for revident in shared:
+                blip.db.Revision.cache_files (self.branch.ident, revident, existing[revident],
+                                              sharedfiles.get (revident, []))
+
+        blip.db.flush ()
+        blip.db.Revision.insert_many (revrows)
+        blip.db.RevisionFile.insert_many (filerows)
+        blip.db.RevisionBranch.insert_many (branchrows)
+        if head is not None:
+            blip.db.BranchHead.set_head (self.branch, head[0], head[1].datetime,
+                                         people[head[1].author_ident].ident)
+        blip.db.Revision.flush_file_cache (limit=blip.db.Revision.file_cache_limit)
+
     def check_history (self):
         since = blip.db.Revision.get_last_revision (branch=self.branch)
         if since is not None:
@@ -315,44 +764,24 @@ class ModuleScanner (object):
             except:
                 pass
         blip.utils.log ('Checking history for %s' % self.branch.ident)
+        commits = []
         for commit in self.repository.read_history (since=since):
-            if commit.author_id is not None:
-                person = blip.db.Entity.get_or_create (commit.author_ident, u'Person')
-            elif commit.author_email is not None:
-                person = blip.db.Entity.get_or_create_email (commit.author_email)
-            else:
-                person = blip.db.Entity.get_or_create (commit.author_ident, u'Ghost')
-
-            if person.type == u'Person':
-                blip.db.Queue.push (person.ident)
-            if commit.author_name is not None:
-                person.extend (name=commit.author_name)
-            if commit.author_email is not None:
-                person.extend (email=commit.author_email)
-            # IMPORTANT: If we were to just set branch and person, instead of
-            # branch_ident and person_ident, Storm would keep referencess to
-            # the Revision object.  That would eat your computer.
-            revident = self.branch.project.ident + u'/' + commit.id
-            rev = blip.db.Revision.select_one(ident=revident)
-            if rev is None:
-                rev = {'ident': revident,
-                       'project_ident': self.branch.project.ident,
-                       'person_ident': person.ident,
-                       'revision': commit.id,
-                       'datetime': commit.datetime,
-                       'comment': commit.comment }
-                if person.ident != commit.author_ident:
-                    rev['person_alias_ident'] = commit.author_ident
-                rev = blip.db.Revision (**rev)
-                rev.decache ()
-                for filename, filerev, prevrev in commit.files:
-                    revfile = rev.add_file (filename, filerev, prevrev)
-                    revfile.decache ()
-            rev.add_branch (self.branch)
-            blip.db.flush()
+            commits.append (commit)
+            if len(commits) >= self.history_batch:
+                self.add_commits (commits)
+                commits = []
+        if len(commits) > 0:
+            self.add_commits (commits)
 
         blip.db.Revision.flush_file_cache ()
-        revision = blip.db.Revision.get_last_revision (branch=self.branch)
-        if revision is not None:
-            self.branch.mod_datetime = revision.datetime
-            self.branch.mod_person = revision.person
+        head = blip.db.BranchHead.get (self.branch.ident)
+        if head is None:
+            # Branches whose history was read before we kept BranchHead
+            # records need one expensive lookup to get started.
+            revision = blip.db.Revision.get_last_revision (branch=self.branch)
+            if revision is not None:
+                head = blip.db.BranchHead.set_head (self.branch, revision.ident,
+                                                    revision.datetime, revision.person_ident)
+        if head is not None:
+            self.branch.mod_datetime = head.datetime
+            self.branch.mod_person_ident = head.person_ident
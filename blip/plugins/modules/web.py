@@ -32,6 +32,8 @@ import blip.plugins.index.web
 ## Pages
 
 class BranchResponder (blip.web.RecordLocator, blip.web.PageResponder):
+    web_paths = ('mod',)
+
     @classmethod
     def locate_record (cls, request):
         if len(request.path) not in (3, 4) or request.path[0] != 'mod':
@@ -86,6 +88,8 @@ class BranchResponder (blip.web.RecordLocator, blip.web.PageResponder):
 ## Tabs
 
 class OverviewTab (blip.html.TabProvider):
+    web_paths = ('mod',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) < 1 or request.path[0] != 'mod':
@@ -149,15 +153,9 @@ class OverviewTab (blip.html.TabProvider):
         facts.start_fact_group ()
         span = blip.html.Span (divider=blip.html.SPACE)
         span.add_content (str(request.record.project.score))
-        lt = blip.db.Project.select (blip.db.Project.type == u'Module',
-                                     blip.db.Project.score != 0,
-                                     blip.db.Project.score <= request.record.project.score)
-        lt = lt.count()
-        gt = blip.db.Project.select (blip.db.Project.type == u'Module',
-                                     blip.db.Project.score > request.record.project.score)
-        gt = gt.count()
-        if (lt + gt) > 0:
-            span.add_content ('(%.2f%%)' % ((100.0 * lt) / (lt + gt)))
+        rank = blip.db.ScoreRank.get_rank (request.record.project_ident)
+        if rank is not None and rank[1] is not None:
+            span.add_content ('(%.2f%%)' % rank[1])
         facts.add_fact (blip.utils.gettext ('Score'), span)
 
         sel = blip.db.Selection (blip.db.BranchForum,
@@ -230,6 +228,8 @@ class OverviewTab (blip.html.TabProvider):
         return response
 
 class DevelopersTab (blip.html.TabProvider):
+    web_paths = ('mod',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) < 1 or request.path[0] != 'mod':
@@ -237,7 +237,8 @@ class DevelopersTab (blip.html.TabProvider):
         if not (isinstance (request.record, blip.db.Branch) and
                 request.record.type == u'Module'):
             return None
-        cnt = blip.db.ModuleEntity.count_related (subj=request.record)
+        cnt = cls.get_count (request, 'developers',
+                             lambda: blip.db.ModuleEntity.count_related (subj=request.record))
         if cnt > 0:
             page.add_tab ('developers',
                           blip.utils.gettext ('Developers (%i)') % cnt,
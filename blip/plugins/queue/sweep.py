@@ -23,6 +23,10 @@ Update information for queued objects
 """
 
 import datetime
+import os
+import socket
+import subprocess
+import sys
 
 import blinq.ext
 
@@ -65,6 +69,18 @@ class QueueResponder (blip.sweep.SweepResponder):
                                  dest='queue_time_limit',
                                  metavar='SECONDS',
                                  help='process the queue for at most SECONDS seconds')
+        request.add_tool_option ('--workers',
+                                 dest='queue_workers',
+                                 metavar='NUM',
+                                 help='run NUM worker processes, each with the other limits')
+        request.add_tool_option ('--claim',
+                                 dest='queue_claim',
+                                 metavar='NUM',
+                                 help='claim NUM entries at a time from the queue (default 10)')
+        request.add_tool_option ('--lease',
+                                 dest='queue_lease',
+                                 metavar='SECONDS',
+                                 help='let other workers take over claims after SECONDS seconds (default 7200)')
         request.add_tool_option ('--no-history',
                                  dest='read_history',
                                  action='store_false',
@@ -122,18 +138,53 @@ class QueueResponder (blip.sweep.SweepResponder):
             timelimit = 3600 * tlhour + 60 * tlmin + tlsec
         timestart = datetime.datetime.now()
 
-        ident_i = 0
-        obj = blip.db.Queue.select_one (*args)
+        workers = request.get_tool_option ('queue_workers')
+        if workers is not None and int(workers) > 1:
+            return cls.run_workers (request, int(workers), limit)
 
-        while obj is not None:
-            ident = obj.ident
+        claimsize = request.get_tool_option ('queue_claim')
+        claimsize = 10 if claimsize is None else max (1, int(claimsize))
+        lease = request.get_tool_option ('queue_lease')
+        lease = 7200 if lease is None else int(lease)
+        worker = blip.utils.utf8dec ('%s:%i' % (socket.gethostname (), os.getpid ()))
+
+        ident_i = 0
+        conflicts = 0
+        claimed = []
+        while True:
+            if len(claimed) == 0:
+                count = claimsize
+                if limit is not None:
+                    count = min (count, limit - ident_i)
+                claimed = blip.db.QueueLease.claim (worker, count, lease, *args)
+                if claimed is None:
+                    conflicts += 1
+                    if conflicts >= 5:
+                        blip.utils.warn ('Giving up on the queue after repeated claim conflicts')
+                        claimed = []
+                        break
+                    claimed = []
+                    continue
+                conflicts = 0
+                if len(claimed) == 0:
+                    break
+            ident = claimed.pop (0)
+            # A claim can sit past its lease while earlier entries are
+            # processed, and another worker may have taken it over.
+            if not blip.db.QueueLease.renew (ident, worker):
+                blip.utils.log ('Lost claim on %s, skipping' % ident)
+                continue
             try:
                 blip.utils.log ('Poppping from queue: %s' % ident)
-                for cls in QueueHandler.get_extensions ():
-                    cls.process_queued (ident, request)
+                for handler in QueueHandler.get_extensions ():
+                    handler.process_queued (ident, request)
                 blip.db.Queue.pop (ident)
+                blip.db.QueueLease.release (ident, worker)
             except:
                 blip.db.rollback ()
+                for ident in [ident] + claimed:
+                    blip.db.QueueLease.release (ident, worker)
+                blip.db.commit ()
                 raise
             else:
                 blip.db.commit ()
@@ -145,10 +196,67 @@ class QueueResponder (blip.sweep.SweepResponder):
                 (datetime.datetime.now() - timestart).seconds > timelimit):
                 break;
 
-            obj = blip.db.Queue.select_one (*args)
+        if len(claimed) > 0:
+            for ident in claimed:
+                blip.db.QueueLease.release (ident, worker)
+            blip.db.commit ()
 
         diff = datetime.datetime.now () - timestart
         diff = datetime.timedelta (days=diff.days, seconds=diff.seconds)
         blip.utils.log ('Queue processed %i records in %s' % (ident_i, diff))
 
         return response
+
+    @classmethod
+    def run_workers (cls, request, workers, limit=None):
+        """
+        Run blip-sweep queue again in several processes.
+
+        Each worker has its own database connection, and the workers
+        claim entries from the queue so they never process the same
+        entry at once.  Each worker gets an even share of limit.
+        """
+        response = blip.sweep.SweepResponse (request)
+        argv = [sys.executable, os.path.abspath (sys.argv[0])]
+        for opt, dest in (('--site', 'site'),
+                          ('--log-file', 'log_file'),
+                          ('--log-level', 'log_level'),
+                          ('--disable', 'disable_pkgs')):
+            value = request.get_common_option (dest)
+            if value:
+                argv += [opt, value]
+        for opt, dest in (('--debug-db', 'debug_db'),
+                          ('--debug-db-summary', 'debug_db_summary'),
+                          ('--rollback', 'rollback')):
+            if request.get_common_option (dest):
+                argv.append (opt)
+        argv.append (cls.command)
+        for opt, dest in (('--time-limit', 'queue_time_limit'),
+                          ('--claim', 'queue_claim'),
+                          ('--lease', 'queue_lease')):
+            value = request.get_tool_option (dest)
+            if value is not None:
+                argv += [opt, value]
+        for opt, dest in (('--no-history', 'read_history'),
+                          ('--no-timestamps', 'timestamps'),
+                          ('--no-update', 'update_scm')):
+            if not request.get_tool_option (dest, True):
+                argv.append (opt)
+        argv += ['--workers', '1']
+
+        procs = []
+        for i in range (workers):
+            workerargv = list(argv)
+            if limit is not None:
+                share = limit // workers + (1 if i < limit % workers else 0)
+                if share == 0:
+                    break
+                workerargv += ['--limit', str(share)]
+            procs.append (subprocess.Popen (workerargv + request.get_tool_args ()))
+        failed = 0
+        for proc in procs:
+            if proc.wait () != 0:
+                failed += 1
+        if failed > 0:
+            response.set_error (1, '%i of %i queue workers failed' % (failed, len(procs)))
+        return response
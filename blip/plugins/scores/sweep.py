@@ -56,3 +56,48 @@ class ScoreUpdater (blinq.ext.ExtensionPoint):
     @classmethod
     def update_scores (cls, request, ident):
         pass
+
+    @staticmethod
+    def set_scores (table, counts, current):
+        """
+        Set the score and score_diff of many records at once.
+
+        The counts are tuples of an ident, a week number, and a count for
+        the last 26 weeks, usually from one GROUP BY query.  The current
+        values are tuples of an ident, a score, and a score_diff for every
+        record to update.  Records with no counts get a score of zero.
+        This returns a dictionary mapping each ident in current to its new
+        score and score_diff.
+        """
+        scores = blip.utils.score_counts (counts)
+        ret = {}
+        for ident, score, score_diff in current:
+            ret[ident] = scores.get (ident, (0, 0))
+        ScoreUpdater.write_scores (table, ret, current)
+        return ret
+
+    @staticmethod
+    def write_scores (table, scores, current):
+        """
+        Write scores to records, skipping ones that haven't changed.
+
+        The scores are a dictionary mapping idents to tuples of a score and
+        a score_diff, and the current values are tuples of an ident, a score,
+        and a score_diff.  Records are updated with one UPDATE for each
+        distinct pair of values that changed.
+        """
+        store = blip.db.get_store (table)
+        changed = {}
+        for ident, score, score_diff in current:
+            new = scores.get (ident)
+            if new is not None and new != (score, score_diff):
+                changed.setdefault (new, []).append (ident)
+        numchanged = 0
+        for (score, score_diff), idents in changed.iteritems ():
+            numchanged += len(idents)
+            blip.db.CacheVersion.bump (*idents)
+            for start in range (0, len(idents), 500):
+                store.find (table, table.ident.is_in (idents[start:start + 500])).set (
+                    score=score, score_diff=score_diff)
+        blip.utils.log ('Updated scores for %i of %i records in %s'
+                        % (numchanged, len(scores), table.__name__))
@@ -72,6 +72,8 @@ class SetsResponder (blip.sweep.SweepResponder):
     def update_set (cls, data, request, parent=None):
         ident = u'/set/' + data['blip:id']
         record = blip.db.ReleaseSet.get_or_create (ident, u'Set')
+        blip.db.CacheVersion.bump (ident)
+        blip.db.RecordSummary.touch (record)
         if parent:
             record.parent = parent
 
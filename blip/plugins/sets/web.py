@@ -33,6 +33,8 @@ import blip.plugins.index.web
 ## Pages
 
 class AllSetsResponder (blip.web.PageResponder):
+    web_paths = ('set',)
+
     @classmethod
     def respond (cls, request, **kw):
         if len(request.path) != 1 or request.path[0] != 'set':
@@ -49,22 +51,27 @@ class AllSetsResponder (blip.web.PageResponder):
 
         sets = blip.db.ReleaseSet.select (parent=None)
         sets = blinq.utils.attrsorted (list(sets), 'title')
+        allsubsets = blip.db.ReleaseSet.get_subsets ([rset.ident for rset in sets])
+        counts = blip.db.ReleaseSet.count_branches ([rset.ident for rset in sets
+                                                     if len(allsubsets[rset.ident]) == 0])
         for rset in sets:
             lbox = cont.add_link_box (rset)
-            subsets = blinq.utils.attrsorted (list(rset.subsets), ['title'])
+            subsets = blinq.utils.attrsorted (allsubsets[rset.ident], ['title'])
             if len(subsets) > 0:
                 bl = blip.html.BulletList ()
                 lbox.add_content (bl)
                 for subset in subsets:
                     bl.add_link (subset)
             else:
-                SetResponder.add_set_info (rset, lbox)
+                SetResponder.add_set_info (rset, lbox, counts[rset.ident])
 
         response.payload = page
         return response
 
 
 class SetResponder (blip.web.RecordLocator, blip.web.PageResponder):
+    web_paths = ('set',)
+
     @classmethod
     def locate_record (cls, request):
         if len(request.path) < 2 or request.path[0] != 'set':
@@ -129,8 +136,16 @@ class SetResponder (blip.web.RecordLocator, blip.web.PageResponder):
             return supers + [superset]
 
     @staticmethod
-    def add_set_info (record, lbox):
-        cnt = blip.db.SetModule.count_related (subj=record)
+    def add_set_info (record, lbox, counts=None):
+        """
+        Add links with counts of the modules and other branches in a set.
+
+        Pass counts from ReleaseSet.count_branches when adding info for
+        many sets, so they can all be counted at once.
+        """
+        if counts is None:
+            counts = blip.db.ReleaseSet.count_branches ([record.ident])[record.ident]
+        cnt = counts.get (u'Module', 0)
         if cnt > 0:
             bl = blip.html.BulletList ()
             lbox.add_content (bl)
@@ -140,31 +155,25 @@ class SetResponder (blip.web.RecordLocator, blip.web.PageResponder):
             return
 
         # Documents
-        cnt = blip.db.Branch.select (type=u'Document', parent_in_set=record)
-        cnt = cnt.count()
+        cnt = counts.get (u'Document', 0)
         if cnt > 0:
             bl.add_link (record.blip_url + '#docs',
                          blip.utils.gettext ('%i documents') % cnt)
 
         # Domains
-        cnt = blip.db.Branch.select (type=u'Domain', parent_in_set=record)
-        cnt = cnt.count()
+        cnt = counts.get (u'Domain', 0)
         if cnt > 0:
             bl.add_link (record.blip_url + '#domains',
                          blip.utils.gettext ('%i domains') % cnt)
 
         # Programs
-        objs = blip.db.Branch.select (
-            blip.db.Branch.type.is_in ((u'Application', u'Capplet', u'Applet')),
-            parent_in_set=record)
-        cnt = objs.count()
+        cnt = sum ([counts.get (type, 0) for type in (u'Application', u'Capplet', u'Applet')])
         if cnt > 0:
             bl.add_link (record.blip_url + '#apps',
                          blip.utils.gettext ('%i applications') % cnt)
 
         # Libraries
-        cnt = blip.db.Branch.select (type=u'Library', parent_in_set=record)
-        cnt = cnt.count()
+        cnt = counts.get (u'Library', 0)
         if cnt > 0:
             bl.add_link (record.blip_url + '#libraries',
                          blip.utils.gettext ('%i libraries') % cnt)
@@ -174,17 +183,21 @@ class SetResponder (blip.web.RecordLocator, blip.web.PageResponder):
 ## Tabs
 
 class OverviewTab (blip.html.TabProvider):
+    web_paths = ('set',)
+
     @classmethod
     def add_tabs (cls, page, request):
         if len(request.path) < 2 or request.path[0] != 'set':
             return None
-        cnt = request.record.subsets.count ()
+        cnt = cls.get_count (request, 'subsets',
+                             lambda: request.record.subsets.count ())
         if cnt > 0:
             page.add_tab ('overview',
                           blip.utils.gettext ('Subsets (%i)' % cnt),
                           blip.html.TabProvider.FIRST_TAB)
         else:
-            cnt = blip.db.SetModule.count_related (subj=request.record)
+            cnt = cls.get_count (request, 'modules',
+                                 lambda: blip.db.SetModule.count_related (subj=request.record))
             page.add_tab ('overview',
                           blip.utils.gettext ('Modules (%i)' % cnt),
                           blip.html.TabProvider.FIRST_TAB)
@@ -197,9 +210,10 @@ class OverviewTab (blip.html.TabProvider):
             cont = blip.html.ContainerBox ()
             cont.set_show_icons (False)
             cont.set_columns (2)
+            counts = blip.db.ReleaseSet.count_branches ([subset.ident for subset in subsets])
             for subset in subsets:
                 lbox = cont.add_link_box (subset)
-                SetResponder.add_set_info (subset, lbox)
+                SetResponder.add_set_info (subset, lbox, counts[subset.ident])
             return cont
 
         if request.record is None:
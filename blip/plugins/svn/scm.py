@@ -23,6 +23,7 @@ Read information from an SVN repository.
 """
 
 import codecs
+import commands
 import os
 
 import blip.scm
@@ -120,6 +121,28 @@ class SvnCheckout (blip.scm.Repository):
             return retval
 
 
+    def get_changed_files (self, since):
+        """
+        Get the files that changed in an SVN repository since a revision.
+        """
+        owd = os.getcwd ()
+        try:
+            os.chdir (self.directory)
+            cmd = 'svn diff --summarize -r %s:HEAD .' % since
+            (status, output) = commands.getstatusoutput (cmd)
+        finally:
+            os.chdir (owd)
+        if status != 0:
+            raise blip.scm.RepositoryError ('Could not read changes since %s for %s'
+                                            % (since, self.scm_module))
+        files = []
+        for line in output.split ('\n'):
+            filename = blip.utils.utf8dec (line[8:].strip())
+            if filename not in ('', '.'):
+                files.append (filename)
+        return files
+
+
     def read_history (self, since=None):
         """
         Read the history of an SVN repository.
@@ -96,6 +96,16 @@ class Repository (blinq.ext.ExtensionPoint):
         cls._cached_repos[repoid] = obj
         return obj
 
+    @classmethod
+    def clear_cache (cls):
+        """
+        Forget the repositories created so far.
+
+        Long-running processes call this so the next Repository for a
+        checkout is a new one, and gets updated again.
+        """
+        Repository._cached_repos.clear ()
+
     @staticmethod
     def get_default_branch (scm_type):
         for subcls in Repository.get_extensions ():
@@ -256,6 +266,18 @@ class Repository (blinq.ext.ExtensionPoint):
                                    % self.__class__.__name__)
 
 
+    def get_changed_files (self, since):
+        """
+        Get the files that changed since a revision.
+
+        This returns a list of paths relative to the checkout directory.
+        Repositories that can't tell what changed raise NotImplementedError,
+        in which case callers should look at every file.
+        """
+        raise NotImplementedError ('%s does not implement the get_changed_files method.'
+                                   % self.__class__.__name__)
+
+
     def read_history (self, since=None):
         """
         Read the history of a source code repository.
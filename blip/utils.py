@@ -142,11 +142,53 @@ def score (stats):
     where earlier values are weighted down as the square root of their
     distance from the end of the list.
     """
+    weights = _score_weights.get (len(stats))
+    if weights is None:
+        den = math.sqrt (len(stats))
+        weights = [math.sqrt(i + 1) / den for i in range(len(stats))]
+        _score_weights[len(stats)] = weights
     ret = 0
-    den = math.sqrt (len(stats))
     for i in range(len(stats)):
-        ret += (math.sqrt(i + 1) / den) * stats[i]
+        ret += weights[i] * stats[i]
     return int(ret)
+_score_weights = {}
+
+
+def score_with_diff (stats):
+    """
+    Calculate the score and score change for a list of statistics
+
+    The score change is the difference between the score and the score
+    the list would have if its last three values were the average of the
+    values before them.  This returns a tuple of the score and the change.
+    """
+    ret = score (stats)
+    old = stats[:-3]
+    avg = int(round(sum(old) / (len(old) * 1.0)))
+    return (ret, ret - score (old + [avg, avg, avg]))
+
+
+def score_counts (counts, thisweek=None):
+    """
+    Calculate scores for many things from weekly counts
+
+    This takes an iterable of tuples of an ident, a week number, and a count,
+    covering the 26 weeks up to and including thisweek.  It returns a
+    dictionary mapping each ident to a tuple from score_with_diff.
+    """
+    if thisweek is None:
+        thisweek = weeknum ()
+    start = thisweek - 25
+    stats = {}
+    for ident, week, cnt in counts:
+        identstats = stats.get (ident)
+        if identstats is None:
+            identstats = stats[ident] = [0] * 26
+        identstats[week - start] = cnt
+    ret = {}
+    for ident, identstats in stats.iteritems ():
+        ret[ident] = score_with_diff (identstats)
+    return ret
 
 
 def split (things, num):
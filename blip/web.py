@@ -20,9 +20,10 @@
 #
 
 import cgi
-import Cookie
 import os
 import sys
+import threading
+import time
 
 import blinq.config
 import blinq.ext
@@ -37,6 +38,7 @@ class WebRequest (blinq.reqs.web.WebRequest):
         self.record = None
         self.account = None
         self.account_locator = None
+        self.account_located = False
 
 
 class WebResponse (blinq.reqs.web.WebResponse):
@@ -45,19 +47,28 @@ class WebResponse (blinq.reqs.web.WebResponse):
 
 
 class WebResponder (blinq.reqs.Responder):
+    _initialized = False
+    _init_lock = threading.Lock ()
+    _account_handler = None
+    _routes = {}
+
     @classmethod
-    def respond (cls, request):
-        try:
+    def initialize (cls):
+        """
+        Import the web plugins and pick the account handler.
+
+        This only does anything the first time it's called in a process.
+        """
+        if cls._initialized:
+            return
+        with cls._init_lock:
+            if cls._initialized:
+                return
             import blip.plugins
             blinq.ext.import_extensions (blip.plugins, 'web')
 
-            # First, let an AccountHandler set request.account.  This could
-            # be based on a login cookie, but it might not for e.g. HTTP
-            # authentication.  We do this first because everything after
-            # this could change its behavior based on whether the user is
-            # logged in.  We also disable any account handler except the
-            # active one, because account handlers are usually header
-            # links providers
+            # We disable any account handler except the active one,
+            # because account handlers are usually header links providers.
             try:
                 account_handler = blinq.config.account_handler
             except:
@@ -68,9 +79,80 @@ class WebResponder (blinq.reqs.Responder):
                     blinq.ext.ExtensionPoint.disable_extension (ext)
                 elif ext.account_handler == account_handler:
                     handler = ext
-                    handler.locate_account (request)
                 else:
                     blinq.ext.ExtensionPoint.disable_extension (ext)
+            cls._account_handler = handler
+
+            for base in (RecordLocator, PageResponder, ContentResponder, DataResponder):
+                cls._routes[base] = cls.get_routes (base)
+            cls._initialized = True
+
+    @classmethod
+    def get_routes (cls, base):
+        """
+        Index the extensions of base by the paths and queries they handle.
+
+        The index maps each pair of a known first path component and a known
+        query value to the matching extensions, in their usual order.  Paths
+        and queries no extension names are looked up as None, and only match
+        extensions that handle any path or query.
+        """
+        exts = base.get_extensions ()
+        paths = set([None])
+        queries = set([None])
+        for ext in exts:
+            paths.update (ext.web_paths or ())
+            queries.update (getattr (ext, 'web_queries', None) or ())
+        routes = {'paths': paths, 'queries': queries}
+        for path in paths:
+            for query in queries:
+                routes[(path, query)] = [
+                    ext for ext in exts
+                    if (ext.web_paths is None or path in ext.web_paths) and
+                    (getattr (ext, 'web_queries', None) is None or query in ext.web_queries)]
+        return routes
+
+    @classmethod
+    def get_routed (cls, base, request, query=None):
+        """
+        Get the extensions of base that handle the request path and query.
+        """
+        routes = cls._routes[base]
+        if len(request.path) > 0:
+            path = request.path[0]
+        else:
+            path = ''
+        if path not in routes['paths']:
+            path = None
+        if query not in routes['queries']:
+            query = None
+        return routes[(path, query)]
+
+    @classmethod
+    def locate_account (cls, request):
+        """
+        Let the account handler set request.account, if it hasn't yet.
+        """
+        cls.initialize ()
+        if request.account_located:
+            return
+        request.account_located = True
+        handler = cls._account_handler
+        if handler is not None:
+            handler.locate_account (request)
+
+    @classmethod
+    def respond (cls, request):
+        try:
+            cls.initialize ()
+
+            # First, let an AccountHandler set request.account.  This could
+            # be based on a login cookie, but it might not for e.g. HTTP
+            # authentication.  We do this first because everything after
+            # this could change its behavior based on whether the user is
+            # logged in.
+            cls.locate_account (request)
+            handler = cls._account_handler
 
             # The AccountHandler gets to handle everything that starts with
             # /account.  If the handler wants to enable plugins to provide
@@ -88,8 +170,9 @@ class WebResponder (blinq.reqs.Responder):
             # Usually, this involves matching PATH_INFO against an ident, but
             # locate_record returns a boolean, so record locators can claim
             # they've located something even when there's no database entry.
+            # Only locators whose web_paths match the path are asked.
             locator = None
-            for loc in RecordLocator.get_extensions ():
+            for loc in cls.get_routed (RecordLocator, request):
                 if loc.locate_record (request):
                     locator = loc
                     break
@@ -99,10 +182,13 @@ class WebResponder (blinq.reqs.Responder):
             # content or d= for other data.
             if request.query.has_key ('q'):
                 responderbase = ContentResponder
+                query = request.query['q']
             elif request.query.has_key ('d'):
                 responderbase = DataResponder
+                query = request.query['d']
             else:
                 responderbase = PageResponder
+                query = None
 
             # Usually, the RecordLocator and PageResponder will be the same
             # class.  So for normal page requests, we give locator the first
@@ -119,7 +205,7 @@ class WebResponder (blinq.reqs.Responder):
 
             # If locator didn't pan out, give other responders a shot.
             if response is None:
-                for responder in responderbase.get_extensions ():
+                for responder in cls.get_routed (responderbase, request, query):
                     try:
                         response = responder.respond (request)
                     except:
@@ -151,10 +237,200 @@ class WebResponder (blinq.reqs.Responder):
 
         return response
 
+class WebApplication (object):
+    """
+    A WSGI application for Blip.
+
+    Plugins are imported once, when the application is created.  Each
+    request is rendered in the server thread that iterates over its
+    response, using that thread's stores from blip.db, so this can run in
+    threaded and preforking servers alike.  Output is rendered into chunks
+    of chunk_size bytes, which the response yields one at a time.
+
+    Responses to anonymous GET requests are kept in a ResponseCache for
+    web_cache_time seconds, or until a sweep changes a record they show.
+    """
+    chunk_size = 16384
+
+    def __init__ (self):
+        import blip.db
+        blip.db.block_implicit_flushes ()
+        blip.utils.set_log_level (None)
+        WebResponder.initialize ()
+        self.cache = ResponseCache (blinq.config.web_cache_time)
+
+    def __call__ (self, environ, start_response):
+        return self.iter_response (environ, start_response)
+
+    def iter_response (self, environ, start_response):
+        """
+        Yield the chunks of the response for a request.
+
+        Nothing is rendered until the server starts iterating.  Rendered
+        responses are cached once the last chunk is out.
+        """
+        import blip.db
+        try:
+            request = WebRequest (environ=environ, stdin=environ['wsgi.input'])
+            WebResponder.locate_account (request)
+            key = self.cache.get_key (request)
+            cached = None
+            if key is not None:
+                versions = self.cache.get_versions (environ)
+                cached = self.cache.get (key, versions)
+            if cached is None:
+                response = WebResponder.respond (request)
+                status = response.get_response ()
+                blip.db.rollback ()
+                chunks = []
+                fp = ChunkedWriter (chunks.append, self.chunk_size)
+                response.output_payload (fp=fp)
+                fp.flush ()
+        finally:
+            blip.db.rollback ()
+
+        if cached is not None:
+            start_response (cached[0], cached[1])
+            yield cached[2]
+            return
+
+        start_response (*status)
+        for chunk in chunks:
+            yield chunk
+        if key is not None:
+            self.cache.set (key, versions, status[0], status[1], ''.join (chunks))
+
+
+class ResponseCache (object):
+    """
+    An in-memory cache of whole responses for a WSGI process.
+
+    Responses are keyed on the path and query string.  Only responses to
+    GET requests without an account are cached, so there's no need to key
+    on the account.  Each response is stored along with the
+    CacheVersion versions of the idents for its path and each parent path,
+    and is thrown out when any of those changes.  Versions are looked up
+    at most every version_time seconds, so hot pages usually don't touch
+    the database at all.
+    """
+    max_entries = 1000
+    version_time = 30
+
+    def __init__ (self, cache_time):
+        self._cache_time = cache_time
+        self._entries = {}
+        self._versions = {}
+        self._tick = 0
+        self._lock = threading.Lock ()
+
+    def get_key (self, request):
+        """
+        Get the cache key for a request, or None if it can't be cached.
+
+        The account handler must already have located the request's account.
+        """
+        if self._cache_time <= 0:
+            return None
+        if (request.getenv ('REQUEST_METHOD') or 'GET') != 'GET':
+            return None
+        if request.account is not None:
+            return None
+        return (request.getenv ('PATH_INFO') or '', request.getenv ('QUERY_STRING') or '')
+
+    def get_versions (self, environ):
+        """
+        Get the versions of the records a request's path could show.
+        """
+        import blip.db
+        path = [part for part in environ.get ('PATH_INFO', '').split ('/') if part != '']
+        idents = tuple ([blip.utils.utf8dec (u'/' + u'/'.join (path[:i]))
+                         for i in range (1, len(path) + 1)])
+        now = time.time ()
+        with self._lock:
+            cached = self._versions.get (idents)
+        if cached is not None and now - cached[1] < self.version_time:
+            return cached[0]
+        versions = blip.db.CacheVersion.get_versions (idents)
+        with self._lock:
+            if len(self._versions) >= self.max_entries:
+                self._versions.clear ()
+            self._versions[idents] = (versions, now)
+        return versions
+
+    def get (self, key, versions):
+        """
+        Get a tuple of the status, headers, and body for a key, or None.
+        """
+        with self._lock:
+            entry = self._entries.get (key)
+            if entry is None:
+                return None
+            if entry[0] != versions or time.time () - entry[1] > self._cache_time:
+                del self._entries[key]
+                return None
+            self._tick += 1
+            entry[2] = self._tick
+            return entry[3]
+
+    def set (self, key, versions, status, headers, body):
+        """
+        Cache a response, if it's a successful response with no cookies.
+        """
+        if not status.startswith ('200'):
+            return
+        for header, value in headers:
+            if header.lower () == 'set-cookie':
+                return
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # Drop the least recently used half in one go, so we don't
+                # have to keep the entries sorted.
+                ticks = sorted ([entry[2] for entry in self._entries.values ()])
+                cutoff = ticks[len(ticks) // 2]
+                for oldkey in self._entries.keys ():
+                    if self._entries[oldkey][2] <= cutoff:
+                        del self._entries[oldkey]
+            self._tick += 1
+            self._entries[key] = [versions, time.time (), self._tick,
+                                  (status, list(headers), body)]
+
+
+class ChunkedWriter (object):
+    """
+    A file-like object that passes data to a function in chunks.
+    """
+    def __init__ (self, write, chunk_size):
+        self._write = write
+        self._chunk_size = chunk_size
+        self._chunks = []
+        self._length = 0
+
+    def write (self, data):
+        if isinstance (data, unicode):
+            data = data.encode ('utf-8')
+        self._chunks.append (data)
+        self._length += len(data)
+        if self._length >= self._chunk_size:
+            self.flush ()
+
+    def writelines (self, lines):
+        for line in lines:
+            self.write (line)
+
+    def flush (self):
+        if self._length > 0:
+            self._write (''.join (self._chunks))
+        self._chunks = []
+        self._length = 0
+
+
 ################################################################################
 ## Extension Points
 
 class RecordLocator (blinq.ext.ExtensionPoint):
+    # The first path components this locator handles, or None for any
+    web_paths = None
+
     @classmethod
     def locate_record (cls, request):
         return False
@@ -167,10 +443,18 @@ class AccountHandler (blinq.reqs.Responder):
         return False
         
 class PageResponder (blinq.reqs.Responder):
-    pass
+    # The first path components this responder handles, or None for any
+    web_paths = None
+    web_queries = None
 
 class ContentResponder (blinq.reqs.Responder):
-    pass
+    # The first path components and values of q this responder handles,
+    # or None for any
+    web_paths = None
+    web_queries = None
 
 class DataResponder (blinq.reqs.Responder):
-    pass
+    # The first path components and values of d this responder handles,
+    # or None for any
+    web_paths = None
+    web_queries = None
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Copyright (c) 2006-2010  Shaun McCance  <shaunm@gnome.org>
+#
+# This file is part of Blip, a program for displaying various statistics
+# of questionable relevance about software and the people who make it.
+#
+# Blip is free software; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# Blip is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Blip; if not, write to the Free Software Foundation, 59 Temple Place,
+# Suite 330, Boston, MA  0211-1307  USA.
+#
+
+
+"""
+Check that merging two people moves their weekly activity
+
+Run this with the name of a site whose database already exists.  Nothing
+is committed; everything is rolled back at the end.
+"""
+
+import sys
+sys.path.append ('..')
+
+import blip.config
+import blip.db
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        site = sys.argv[1]
+    else:
+        site = 'blip'
+    blip.config.init (site)
+
+    new = blip.db.Entity (u'/person/test-activity-new', u'Person')
+    old = blip.db.Entity (u'/person/test-activity-old', u'Person')
+    blip.db.ActivityWeek.add (new.ident, u'Commit', 100, 2)
+    blip.db.ActivityWeek.add (old.ident, u'Commit', 100, 3)
+    blip.db.ActivityWeek.add (old.ident, u'Commit', 101, 4)
+    blip.db.ActivityWeek.flush_counts ()
+
+    try:
+        blip.db.Alias.update_alias (new, old.ident)
+        blip.db.ActivityWeek.flush_counts ()
+
+        counts = {}
+        for row in blip.db.ActivityWeek.select (owner_ident=new.ident):
+            counts[(row.kind, row.weeknum)] = row.count
+        expected = {(u'Commit', 100): 5, (u'Commit', 101): 4}
+        leftover = blip.db.ActivityWeek.select (owner_ident=old.ident).count ()
+        if counts == expected and leftover == 0:
+            print 'OK'
+        else:
+            print 'FAIL: counts %s, %i rows left on old' % (counts, leftover)
+            sys.exit (1)
+    finally:
+        blip.db.rollback ()
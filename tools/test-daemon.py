@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# Copyright (c) 2006-2010  Shaun McCance  <shaunm@gnome.org>
+#
+# This file is part of Blip, a program for displaying various statistics
+# of questionable relevance about software and the people who make it.
+#
+# Blip is free software; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# Blip is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Blip; if not, write to the Free Software Foundation, 59 Temple Place,
+# Suite 330, Boston, MA  0211-1307  USA.
+#
+
+
+"""
+Check the control socket protocol of a running blip-sweep daemon
+
+Pass the socket file the daemon listens on.  Without more arguments, only
+requests the daemon must reject are sent, so nothing is run.  Any further
+arguments are sent as one command, and the reply is printed.
+"""
+
+import socket
+import sys
+
+def send (sockfile, line):
+    sock = socket.socket (socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout (10)
+        sock.connect (sockfile)
+        sock.sendall (line + '\n')
+        reply = ''
+        while not reply.endswith ('\n'):
+            data = sock.recv (4096)
+            if data == '':
+                break
+            reply += data
+        return reply.strip ()
+    finally:
+        sock.close ()
+
+def check (sockfile, line, expected):
+    reply = send (sockfile, line)
+    if reply.startswith (expected):
+        print 'OK: %r -> %r' % (line, reply)
+        return True
+    print 'FAIL: %r -> %r, expected %r' % (line, reply, expected)
+    return False
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print 'Usage: %s SOCKET [COMMAND...]' % sys.argv[0]
+        sys.exit (1)
+    sockfile = sys.argv[1]
+    if len(sys.argv) > 2:
+        print send (sockfile, ' '.join (sys.argv[2:]))
+        sys.exit (0)
+    ok = True
+    ok = check (sockfile, '', 'error: no command') and ok
+    ok = check (sockfile, '   ', 'error: no command') and ok
+    ok = check (sockfile, 'no-such-command', 'error: unknown command no-such-command') and ok
+    ok = check (sockfile, 'daemon', 'error: unknown command daemon') and ok
+    if not ok:
+        sys.exit (1)